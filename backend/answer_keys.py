@@ -0,0 +1,143 @@
+"""
+Кэш ключей ответов для проверки тестов.
+При отправке теста нужны только правильные ответы и пояснения, поэтому
+они один раз читаются из базы и дальше проверка - поиск в словаре.
+Маршруты администратора сбрасывают ключ теста при изменении его вопросов.
+Для тестов со случайным вариантом в ключе хранятся только id вопросов банка
+(читаются по индексу (test_id, tag)): по номеру попытки (seed) набор выбирается
+без обращения к базе, а сами вопросы варианта читаются по первичному ключу
+"""
+
+import json
+import random
+import secrets
+import threading
+import time
+
+from flask import current_app
+
+from models import db, Test, Question
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+# Срок жизни ключа страхует от устаревания, когда вопросы изменены в другом процессе сервера
+DEFAULT_ANSWER_KEY_TTL = 300
+
+_keys = {}
+_versions = {}  # растёт при каждом сбросе, чтобы не сохранить ключ, прочитанный до изменения
+_lock = threading.Lock()
+
+
+def load_answer_key(test_id):
+    """Прочитать ключ ответов теста из базы (только нужные столбцы) или None, если теста нет"""
+    test = db.session.query(
+        Test.id, Test.passing_score, Test.pool_size, Test.pool_tag
+    ).filter_by(id=test_id).first()
+    if test is None:
+        return None
+
+    if test.pool_size:
+        # Банк варианта: только id вопросов в постоянном порядке, из него выбираются вопросы попытки
+        query = db.session.query(Question.id).filter_by(test_id=test_id)
+        if test.pool_tag is not None:
+            query = query.filter_by(tag=test.pool_tag)
+        return {
+            'passing_score': test.passing_score,
+            'pool_size': test.pool_size,
+            'pool': [row.id for row in query.order_by(Question.order, Question.id)]
+        }
+
+    rows = _question_query().filter_by(test_id=test_id).order_by(Question.order, Question.id).all()
+    questions = [_question_entry(row) for row in rows]
+    return {
+        'passing_score': test.passing_score,
+        'questions': questions,
+        'by_id': {question['id']: question for question in questions},
+        'pool_size': test.pool_size
+    }
+
+
+def _question_query():
+    """Запрос столбцов вопроса, нужных для проверки ответов"""
+    return db.session.query(
+        Question.id,
+        Question.question_text,
+        Question.correct_answer,
+        Question.explanation,
+        Question.question_type,
+        Question.test_cases,
+        Question.stop_on_failure,
+        Question.tag
+    )
+
+
+def _question_entry(row):
+    """Вопрос в ключе ответов"""
+    is_code = row.question_type == 'code'
+    return {
+        'id': row.id,
+        'question_text': row.question_text,
+        'correct_answer': None if is_code else row.correct_answer,
+        'explanation': row.explanation,
+        'is_code': is_code,
+        'test_cases': json.loads(row.test_cases) if is_code and row.test_cases else [],
+        'stop_on_failure': bool(row.stop_on_failure),
+        'tag': row.tag
+    }
+
+
+def fetch_questions(question_ids):
+    """Вопросы с данными id (по первичному ключу) в том же порядке; удалённые пропускаются"""
+    if not question_ids:
+        return []
+    by_id = {
+        row.id: _question_entry(row)
+        for row in _question_query().filter(Question.id.in_(question_ids))
+    }
+    return [by_id[question_id] for question_id in question_ids if question_id in by_id]
+
+
+def get_answer_key(test_id):
+    """Ключ ответов теста: проходной балл и вопросы с правильными ответами, или None"""
+    now = time.monotonic()
+    with _lock:
+        entry = _keys.get(test_id)
+        version = _versions.get(test_id, 0)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    key = load_answer_key(test_id)
+    if key is not None:
+        ttl = current_app.config.get('ANSWER_KEY_TTL', DEFAULT_ANSWER_KEY_TTL)
+        with _lock:
+            if _versions.get(test_id, 0) == version:
+                _keys[test_id] = (now + ttl, key)
+    return key
+
+
+def new_seed():
+    """Номер нового случайного варианта"""
+    return secrets.randbelow(2 ** 31)
+
+
+def draw_question_ids(key, seed):
+    """Id вопросов попытки с номером seed: выборка pool_size вопросов из банка.
+    Для одного seed набор всегда одинаков, пока не изменились вопросы теста.
+    random.sample по большому банку работает за O(pool_size), а не за размер банка"""
+    pool = key['pool']
+    size = min(key['pool_size'], len(pool))
+    return random.Random(seed).sample(pool, size)
+
+
+def attempt_questions(key, seed=None):
+    """Вопросы попытки: все вопросы теста или случайный вариант с номером seed
+    (вопросы варианта читаются из базы по первичному ключу)"""
+    if not key['pool_size']:
+        return key['questions']
+    return fetch_questions(draw_question_ids(key, seed))
+
+
+def invalidate(test_id):
+    """Сбросить ключ ответов теста после изменения его вопросов"""
+    with _lock:
+        _keys.pop(test_id, None)
+        _versions[test_id] = _versions.get(test_id, 0) + 1
@@ -17,6 +17,51 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'None'
 app.config['SESSION_COOKIE_SECURE'] = True  # обязательно для HTTPS
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_PATH'] = '/'
+# Пул прогретых интерпретаторов для компилятора
+app.config['COMPILER_POOL_SIZE'] = 4
+app.config['COMPILER_MAX_RUNS_PER_WORKER'] = 50
+# Пул для пакетных проверок администратора (по умолчанию по процессу на ядро)
+app.config['COMPILER_BATCH_POOL_SIZE'] = os.cpu_count() or 1
+# Автопроверка задач с кодом: время на один тестовый случай и число параллельных случаев
+app.config['COMPILER_CASE_TIMEOUT'] = 2
+# Отдельный пул проверки решений: его процессы не выполняют произвольный код с /execute
+app.config['COMPILER_GRADING_POOL_SIZE'] = 4
+app.config['COMPILER_GRADING_PARALLEL'] = os.cpu_count() or 1
+# Ограничения ресурсов для кода студентов (остальные значения по умолчанию в sandbox.py)
+app.config['COMPILER_LIMITS'] = {
+    'cpu': 5,
+    'memory': 256 * 1024 * 1024,
+    'output': 1024 * 1024
+}
+# Асинхронная очередь заданий компилятора
+app.config['COMPILER_MAX_CONCURRENT_JOBS'] = 4
+app.config['COMPILER_MAX_QUEUED_JOBS'] = 100
+# Кэш результатов детерминированного кода
+app.config['COMPILER_CACHE_SIZE'] = 1024
+app.config['COMPILER_CACHE_TTL'] = 3600
+# Срок жизни кэша ключей ответов к тестам (сбрасывается и при изменении вопросов)
+app.config['ANSWER_KEY_TTL'] = 300
+# Отложенная запись результатов тестов пачками (для наплыва отправок во время экзамена)
+app.config['RESULTS_WRITE_BEHIND'] = False
+app.config['RESULTS_BATCH_SIZE'] = 100
+app.config['RESULTS_FLUSH_INTERVAL'] = 1.0
+# Сколько ответов на отправки тестов держать в памяти для повторов с тем же ключом попытки
+app.config['SUBMIT_IDEMPOTENCY_CACHE_SIZE'] = 10000
+# Черновики ответов копятся в памяти и сбрасываются в базу раз в столько секунд
+app.config['DRAFT_FLUSH_INTERVAL'] = 5.0
+# Таблицы лидеров дочитывают новые результаты других процессов раз в столько секунд
+# (с перекрытием, чтобы не пропустить поздно зафиксированные) и перезагружаются целиком,
+# чтобы учесть удаления
+app.config['LEADERBOARD_REFRESH_INTERVAL'] = 60
+app.config['LEADERBOARD_REFRESH_OVERLAP'] = 300
+app.config['LEADERBOARD_REBUILD_INTERVAL'] = 600
+# Интерактивные сессии: число открытых, простой до закрытия (секунды) и предел памяти
+app.config['COMPILER_MAX_SESSIONS'] = 20
+app.config['COMPILER_SESSION_IDLE_TIMEOUT'] = 600
+app.config['COMPILER_SESSION_MAX_MEMORY'] = 128 * 1024 * 1024
+# Не чаще 5 открытий сессии за минуту на пользователя
+app.config['COMPILER_SESSION_CREATE_LIMIT'] = 5
+app.config['COMPILER_SESSION_CREATE_WINDOW'] = 60
 
 
 # Настройка CORS для работы с React frontend
@@ -26,14 +71,18 @@ CORS(app, supports_credentials=True)
      #, origins=["https://python-course-flax.vercel.app"])
 
 # Импорт моделей (они создают db экземпляр)
-from models import db, Lecture, Test, Question, TestResult, init_db
+from models import db, Lecture, Test, Question, TestResult, TestDraft, init_db, upgrade_schema
+import result_writer
 
 # Инициализация базы данных
 init_db(app)
 
-# Создание таблиц в базе данных
+# Создание таблиц в базе данных и недостающих столбцов в существующих
 with app.app_context():
     db.create_all()
+    upgrade_schema()
+    # Запускаем отложенную запись заранее: она досохранит результаты прошлого запуска
+    result_writer.get_writer()
 
 # Импорт маршрутов
 from routes import lectures, tests, admin, auth, users, compiler
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Перенос ответов из старых результатов тестов в таблицу result_answers.
+Новые результаты сохраняются сразу с ответами по вопросам, а у старых ответы
+есть только JSON-строкой в test_results.answers. Скрипт обходит такие результаты
+пачками по возрастанию id, так что его можно прервать и запустить снова.
+
+Набор вопросов попытки и правильность ответов восстанавливаются по текущим
+вопросам теста: если вопрос с тех пор изменили, правильность может отличаться
+от выставленной тогда оценки. Для задач с кодом правильность неизвестна (None).
+Перенесённые ответы сразу учитываются в анализе вопросов; --rebuild-item-analysis
+пересчитывает его суммы целиком по result_answers
+
+Примеры:
+    python backfill_answers.py
+    python backfill_answers.py --batch-size 500 --max-batches 10
+    python backfill_answers.py --rebuild-item-analysis
+"""
+
+import argparse
+import json
+import time
+
+import item_analysis
+from answer_keys import attempt_questions, fetch_questions, load_answer_key
+from models import ANSWER_OPTIONS, db, ResultAnswer, TestResult
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def answer_rows(result, key):
+    """Ответы по вопросам одного результата"""
+    try:
+        answers = json.loads(result.answers) if result.answers else {}
+    except ValueError:
+        answers = {}
+    if not isinstance(answers, dict):
+        answers = {}
+
+    if key is not None and not (key['pool_size'] and result.seed is None):
+        attempt = [(question['id'], question) for question in attempt_questions(key, result.seed)]
+    else:
+        # Тест удалён или набор вопросов не восстановить: переносим только данные ответы
+        question_ids = [int(question_id) for question_id in answers if question_id.isdigit()]
+        by_id = {question['id']: question for question in fetch_questions(question_ids)} if key else {}
+        attempt = [(question_id, by_id.get(question_id)) for question_id in question_ids]
+
+    rows = []
+    for question_id, question in attempt:
+        user_answer = answers.get(str(question_id))
+        is_code = question['is_code'] if question else False
+        if question is None or is_code:
+            is_correct = None
+        else:
+            is_correct = user_answer == question['correct_answer']
+        rows.append({
+            'result_id': result.id,
+            'question_id': question_id,
+            'chosen': user_answer if not is_code and user_answer in ANSWER_OPTIONS else None,
+            'is_correct': is_correct
+        })
+    return rows
+
+
+def backfill(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, log=print):
+    """Перенести ответы результатов, у которых ещё нет строк в result_answers.
+    Каждая пачка - отдельная транзакция. Возвращает (результатов, строк ответов)"""
+    keys = {}
+    last_id = 0
+    batches = results = written = 0
+    while max_batches is None or batches < max_batches:
+        pending = db.session.execute(
+            db.select(TestResult.id, TestResult.test_id, TestResult.seed, TestResult.answers, TestResult.percentage)
+            .where(TestResult.id > last_id)
+            .where(~db.select(ResultAnswer.id).where(ResultAnswer.result_id == TestResult.id).exists())
+            .order_by(TestResult.id)
+            .limit(batch_size)
+        ).all()
+        if not pending:
+            break
+
+        rows = []
+        scores = {}
+        for result in pending:
+            if result.test_id not in keys:
+                keys[result.test_id] = load_answer_key(result.test_id)
+            rows.extend(answer_rows(result, keys[result.test_id]))
+            scores[result.id] = result.percentage / 100
+        if rows:
+            db.session.execute(db.insert(ResultAnswer), rows)
+            item_analysis.record({**row, 'score': scores[row['result_id']]} for row in rows)
+        db.session.commit()
+
+        last_id = pending[-1].id
+        batches += 1
+        results += len(pending)
+        written += len(rows)
+        log(f'Пачка {batches}: результатов {len(pending)}, ответов {len(rows)}, последний id {last_id}')
+    return results, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос ответов из test_results.answers в result_answers')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='результатов в одной транзакции')
+    parser.add_argument('--max-batches', type=int, help='остановиться после стольких пачек')
+    parser.add_argument('--rebuild-item-analysis', action='store_true',
+                        help='после переноса пересчитать суммы анализа вопросов по всем ответам')
+    args = parser.parse_args()
+
+    from app import app
+
+    started = time.perf_counter()
+    with app.app_context():
+        results, written = backfill(args.batch_size, args.max_batches)
+        print(f'Готово: результатов {results}, ответов {written}, {time.perf_counter() - started:.1f} с')
+        if args.rebuild_item_analysis:
+            item_analysis.rebuild()
+            db.session.commit()
+            print('Анализ вопросов пересчитан')
+
+
+if __name__ == '__main__':
+    main()
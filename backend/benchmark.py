@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест компилятора (/api/compiler/execute).
+N параллельных клиентов отправляют смесь фрагментов кода, а скрипт выводит
+пропускную способность, перцентили задержки, число перезапусков рабочих процессов
+пула и число копий процесса (fork), созданных для отдельных запусков.
+Результат в формате JSON (--json) служит базовой линией для изменений пути выполнения
+
+Примеры:
+    python benchmark.py                                  # Flask test client
+    python benchmark.py --target server --clients 8      # настоящий WSGI-сервер в этом процессе
+    python benchmark.py --url http://localhost:5000      # уже запущенный сервер
+    python benchmark.py --mix hello=8,cpu=2,output=1 --requests 1000 --json baseline.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+
+# Фрагменты кода для смеси нагрузки
+SNIPPETS = {
+    'hello': "print('Hello, World!')",
+    'cpu': 'total = 0\nfor i in range(300000):\n    total += i * i\nprint(total)',
+    'syntax': "print('Hello, World!'",
+    'error': 'numbers = [1, 2, 3]\nprint(numbers[10])',
+    'output': "for i in range(20000):\n    print(i, '*' * 20)",
+    'output_limit': "while True:\n    print('*' * 1000)",
+    'timeout': 'import time\ntime.sleep(60)'
+}
+DEFAULT_MIX = 'hello=6,cpu=2,syntax=1,error=1,output=1'
+
+
+def parse_mix(text):
+    """Разобрать смесь вида hello=6,cpu=2 в словарь весов"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SNIPPETS:
+            raise argparse.ArgumentTypeError(f'Неизвестный фрагмент: {name} (есть: {", ".join(SNIPPETS)})')
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Некорректный вес: {part}')
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('Хотя бы один фрагмент должен иметь ненулевой вес')
+    return mix
+
+
+def percentile(values, q):
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(q * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def outcome(status, response):
+    """Краткий итог запроса для сводки"""
+    if status != 200 or response is None:
+        return f'http_{status}'
+    if response.get('success'):
+        return 'success'
+    if response.get('syntax_error'):
+        return 'syntax_error'
+    if response.get('limit'):
+        return f'limit_{response["limit"]}'
+    return 'error'
+
+
+class TestClientTarget:
+    """Запросы через Flask test client, без сети"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+    def get(self, path):
+        response = self.app.test_client().get(path)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """Запросы по HTTP к серверу по адресу base_url"""
+
+    def __init__(self, base_url, server=None):
+        self.base_url = base_url.rstrip('/')
+        self.server = server
+
+    def _request(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read() or b'null')
+            except ValueError:
+                return e.code, None
+
+    def post(self, path, payload):
+        return self._request(urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        ))
+
+    def get(self, path):
+        return self._request(urllib.request.Request(self.base_url + path))
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def create_app(pool_size):
+    """Приложение только с маршрутами компилятора: база данных для нагрузки не нужна"""
+    from flask import Flask
+    from routes import compiler
+
+    app = Flask(__name__)
+    app.config['COMPILER_POOL_SIZE'] = pool_size
+    app.register_blueprint(compiler.bp)
+    return app
+
+
+def start_server(app):
+    """Запустить многопоточный WSGI-сервер Werkzeug на свободном порту"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass  # журнал каждого запроса искажает замер
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    return server
+
+
+def process_counts(target):
+    """Сколько рабочих процессов запустил основной пул и сколько копий процесса
+    создано для запусков (по /metrics): (запущено, копий) или None"""
+    status, response = target.get('/api/compiler/metrics')
+    if status != 200 or not response:
+        return None
+    pool = response['data'].get('executions', {}).get('default')
+    return (pool['spawned'], pool.get('forks', 0)) if pool else (0, 0)
+
+
+def run_benchmark(target, mix, clients, requests, warmup, seed, use_cache):
+    """Отправить requests запросов из clients потоков и собрать результаты"""
+    rng = random.Random(seed)
+    names = list(mix)
+    plan = rng.choices(names, weights=[mix[name] for name in names], k=warmup + requests)
+
+    def payload(number, name):
+        code = SNIPPETS[name]
+        if not use_cache:
+            # Уникальный комментарий: каждый запрос доходит до песочницы, минуя кэш результатов
+            code += f'\n# benchmark {seed} {number}'
+        return {'code': code}
+
+    # Прогрев: первые запросы запускают пул рабочих процессов
+    for number, name in enumerate(plan[:warmup]):
+        target.post('/api/compiler/execute', payload(number, name))
+
+    counts_before = process_counts(target)
+    samples = []
+    samples_lock = threading.Lock()
+    next_index = iter(range(warmup, len(plan)))
+    index_lock = threading.Lock()
+
+    def client_loop():
+        while True:
+            with index_lock:
+                number = next(next_index, None)
+            if number is None:
+                return
+            name = plan[number]
+            started = time.perf_counter()
+            status, response = target.post('/api/compiler/execute', payload(number, name))
+            latency = (time.perf_counter() - started) * 1000
+            with samples_lock:
+                samples.append((name, latency, outcome(status, response)))
+
+    threads = [threading.Thread(target=client_loop, name=f'benchmark-client-{i}') for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    counts_after = process_counts(target)
+    spawned = forks = None
+    if counts_before is not None and counts_after is not None:
+        spawned = counts_after[0] - counts_before[0]
+        forks = counts_after[1] - counts_before[1]
+    return samples, elapsed, spawned, forks
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+        'max_ms': round(latencies[-1], 2) if latencies else None
+    }
+
+
+def per_thousand(count, samples):
+    return round(count / len(samples) * 1000, 2) if count is not None and samples else None
+
+
+def build_report(samples, elapsed, spawned, forks, settings):
+    by_snippet = defaultdict(list)
+    outcomes = defaultdict(Counter)
+    for name, latency, result in samples:
+        by_snippet[name].append(latency)
+        outcomes[name][result] += 1
+
+    return {
+        'settings': settings,
+        'python': sys.version.split()[0],
+        'requests': len(samples),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency': latency_summary([latency for _, latency, _ in samples]),
+        'spawned_workers': spawned,
+        'spawns_per_1000_requests': per_thousand(spawned, samples),
+        # Каждый запуск выполняется в своей копии рабочего процесса
+        'forked_runs': forks,
+        'forks_per_1000_requests': per_thousand(forks, samples),
+        'snippets': {
+            name: {**latency_summary(latencies), 'outcomes': dict(outcomes[name])}
+            for name, latencies in sorted(by_snippet.items())
+        }
+    }
+
+
+def print_report(report):
+    settings = report['settings']
+    print(f'Цель: {settings["target"]}, клиентов: {settings["clients"]}, запросов: {report["requests"]}, '
+          f'кэш: {"да" if settings["cache"] else "нет"}')
+    print(f'Время: {report["elapsed_s"]} с, пропускная способность: {report["throughput_rps"]} запросов/с')
+    latency = report['latency']
+    print(f'Задержка, мс: p50 {latency["p50_ms"]}, p95 {latency["p95_ms"]}, '
+          f'p99 {latency["p99_ms"]}, max {latency["max_ms"]}')
+    if report['spawned_workers'] is not None:
+        print(f'Запущено рабочих процессов: {report["spawned_workers"]} '
+              f'({report["spawns_per_1000_requests"]} на 1000 запросов)')
+        print(f'Копий процесса для запусков: {report["forked_runs"]} '
+              f'({report["forks_per_1000_requests"]} на 1000 запросов)')
+    print()
+    print(f'{"фрагмент":<14}{"кол-во":>8}{"p50":>10}{"p95":>10}{"p99":>10}  итоги')
+    for name, summary in report['snippets'].items():
+        outcomes = ', '.join(f'{result}={count}' for result, count in sorted(summary['outcomes'].items()))
+        print(f'{name:<14}{summary["count"]:>8}{summary["p50_ms"]:>10}{summary["p95_ms"]:>10}'
+              f'{summary["p99_ms"]:>10}  {outcomes}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест /api/compiler/execute')
+    parser.add_argument('--target', choices=['client', 'server'], default='client',
+                        help='client - Flask test client, server - WSGI-сервер Werkzeug в этом процессе')
+    parser.add_argument('--url', help='адрес уже запущенного сервера (вместо --target)')
+    parser.add_argument('--clients', type=int, default=4, help='число параллельных клиентов')
+    parser.add_argument('--requests', type=int, default=200, help='число измеряемых запросов')
+    parser.add_argument('--warmup', type=int, default=8, help='запросов на прогрев (не учитываются)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'веса фрагментов ({", ".join(SNIPPETS)}), по умолчанию {DEFAULT_MIX}')
+    parser.add_argument('--pool-size', type=int, default=4, help='размер пула для --target')
+    parser.add_argument('--seed', type=int, default=1, help='зерно порядка запросов')
+    parser.add_argument('--cache', action='store_true', help='не обходить кэш результатов')
+    parser.add_argument('--json', metavar='FILE', help='сохранить отчёт в JSON')
+    args = parser.parse_args()
+
+    if args.url:
+        target = HttpTarget(args.url)
+        target_name = args.url
+    else:
+        app = create_app(args.pool_size)
+        if args.target == 'server':
+            server = start_server(app)
+            target = HttpTarget(f'http://127.0.0.1:{server.server_port}', server)
+        else:
+            target = TestClientTarget(app)
+        target_name = args.target
+
+    try:
+        samples, elapsed, spawned, forks = run_benchmark(
+            target, args.mix, args.clients, args.requests, args.warmup, args.seed, args.cache
+        )
+    finally:
+        target.close()
+
+    report = build_report(samples, elapsed, spawned, forks, {
+        'target': target_name,
+        'clients': args.clients,
+        'mix': args.mix,
+        'pool_size': None if args.url else args.pool_size,
+        'seed': args.seed,
+        'cache': args.cache
+    })
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Черновики ответов на тесты.
+Во время прохождения браузер сохраняет ответы каждые несколько секунд, и при
+сотнях студентов это тысячи маленьких записей в секунду. Сохранения копятся в
+памяти процесса: частые сохранения одного студента просто заменяют друг друга,
+а в базу (таблица test_drafts) периодически пишутся только последние из них.
+В памяти хранятся только ещё не записанные черновики. Читается черновик всегда
+и из базы, и из памяти, и выигрывает более новый: запросы одного студента могут
+попадать в разные процессы сервера, и при записи черновик тоже заменяет строку
+в базе, только если он новее неё. При отправке теста строка черновика удаляется
+в транзакции результата; черновик другого процесса, записанный уже после этого,
+несёт ключ отправленной попытки, и маршруты такие черновики не выдают.
+
+В строке черновика хранится и номер варианта (seed) теста со случайным вариантом:
+его выдаёт сервер при открытии теста, а при отправке ответов строка удаляется
+вместе с ним. Номер пишется в базу сразу, а не в фоне, поэтому его видят все
+процессы сервера; новый номер всегда начинает попытку с пустого черновика
+"""
+
+import atexit
+import logging
+import operator
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from answer_keys import new_seed
+from models import db, TestDraft, upsert
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_FLUSH_INTERVAL = 5.0  # секунд между сбросами черновиков в базу
+
+logger = logging.getLogger(__name__)
+
+
+class DraftStore:
+    """Несохранённые черновики процесса и фоновый поток, записывающий их в базу"""
+
+    def __init__(self, app, flush_interval):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.saves = 0
+        self.flushes = 0
+        self.written = 0
+        self.failures = 0
+        self.last_error = None
+        self._pending = {}  # ключ -> (JSON, время сохранения), ещё не записанные
+        self._flushing = {}  # черновики, которые сейчас записываются
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name='draft-store', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def save(self, key, data):
+        """Заменить черновик key = (test_id, owner) строкой JSON data"""
+        now = datetime.utcnow()
+        with self._lock:
+            self._pending[key] = (data, now)
+            self.saves += 1
+        return now
+
+    def load(self, key):
+        """Черновик (JSON, время сохранения) или None: более новый из памяти и из базы"""
+        with self._lock:
+            local = self._pending.get(key) or self._flushing.get(key)
+
+        test_id, owner = key
+        row = db.session.execute(
+            db.select(TestDraft.data, TestDraft.updated_at).filter_by(test_id=test_id, owner=owner)
+        ).first()
+        if row is None:
+            return local
+        if local is None or local[1] < row.updated_at:
+            return row.data, row.updated_at
+        return local
+
+    def discard(self, key):
+        """Забыть несохранённый черновик (тест отправлен, строку в базе удалил delete)"""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._flushing.pop(key, None)
+
+    def flush(self):
+        """Записать накопленные черновики в базу; False при ошибке"""
+        with self._flush_lock:
+            with self._lock:
+                # Сохранения после этого момента попадут в следующий сброс
+                saved, self._pending = self._pending, {}
+                self._flushing = saved
+                rows = [
+                    {'test_id': test_id, 'owner': owner, 'data': data, 'updated_at': updated_at}
+                    for (test_id, owner), (data, updated_at) in saved.items()
+                ]
+            if not rows:
+                return True
+
+            try:
+                with self.app.app_context():
+                    # Строку, которую другой процесс уже заменил более новым черновиком, не трогаем
+                    upsert(TestDraft, ['test_id', 'owner'], rows, {
+                        'data': lambda current, new: new,
+                        'updated_at': lambda current, new: new
+                    }, where={'updated_at': operator.lt})
+                    db.session.commit()
+            except Exception as e:
+                logger.exception('Не удалось сохранить черновики тестов')
+                with self._lock:
+                    # Вернём черновики в очередь, если их не перекрыли более новые и не отправили тест
+                    for key, draft in self._flushing.items():
+                        if key not in self._pending:
+                            self._pending[key] = draft
+                    self._flushing = {}
+                    self.failures += 1
+                    self.last_error = str(e)
+                return False
+
+            with self._lock:
+                self._flushing = {}
+                self.flushes += 1
+                self.written += len(rows)
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': True,
+                'pending': len(self._pending),
+                'flush_interval': self.flush_interval,
+                'saves': self.saves,
+                'flushes': self.flushes,
+                'written': self.written,
+                'failures': self.failures,
+                'last_error': self.last_error
+            }
+
+    def shutdown(self):
+        """Остановить поток и сохранить оставшиеся изменения"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        """Фоновый поток: сбрасывать черновики раз в flush_interval"""
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+def issue_seed(test_id, owner):
+    """Вариант незавершённой попытки владельца; если его нет, выдать новый.
+    Повторное открытие теста до отправки возвращает тот же вариант"""
+    select_seed = db.select(TestDraft.seed).filter_by(test_id=test_id, owner=owner)
+    seed = db.session.execute(select_seed).scalar()
+    if seed is not None:
+        return seed
+    # Номер запишет только первый из параллельных запросов, остальные прочитают его.
+    # Ответы и ключ прошлой попытки, если строка осталась от неё, к новому варианту не переходят
+    upsert(TestDraft, ['test_id', 'owner'], [
+        {'test_id': test_id, 'owner': owner, 'data': '{}', 'seed': new_seed(), 'updated_at': datetime.utcnow()}
+    ], {
+        'seed': lambda current, new: new,
+        'data': lambda current, new: new,
+        'updated_at': lambda current, new: new
+    }, where={'seed': lambda current, new: current.is_(None)})
+    seed = db.session.execute(select_seed).scalar()
+    db.session.commit()
+    return seed
+
+
+def delete(test_id, owner):
+    """Удалить черновик владельца из базы в текущей транзакции (тест отправлен)"""
+    db.session.execute(db.delete(TestDraft).filter_by(test_id=test_id, owner=owner))
+
+
+def consume_seed(test_id, owner):
+    """Забрать выданный владельцу вариант при отправке ответов: строка черновика удаляется
+    вместе с ним в текущей транзакции. None - вариант не выдавался или уже отправлен.
+    Если транзакцию откатить, вариант и черновик вернутся"""
+    seed = db.session.execute(
+        db.select(TestDraft.seed).filter_by(test_id=test_id, owner=owner)
+    ).scalar()
+    if seed is None:
+        return None
+    # Условие на seed: из двух параллельных отправок вариант достанется одной
+    taken = db.session.execute(
+        db.delete(TestDraft).filter_by(test_id=test_id, owner=owner, seed=seed)
+    )
+    return seed if taken.rowcount else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Получить хранилище черновиков процесса, создав его при первом обращении"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DraftStore(
+                current_app._get_current_object(),
+                current_app.config.get('DRAFT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+            )
+    return _store
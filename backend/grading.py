@@ -0,0 +1,91 @@
+"""
+Автопроверка задач с кодом.
+Решение студента прогоняется на скрытых тестовых случаях в одном прогретом
+рабочем процессе пула проверки (sandbox.get_grading_pool): случаи выполняются
+параллельно в его копиях, а ожидаемый вывод остаётся на сервере и коду студента недоступен
+"""
+
+import os
+
+from flask import current_app
+
+import sandbox
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_CASE_TIMEOUT = 2  # секунд на один тестовый случай
+
+
+def validate_test_cases(test_cases):
+    """Проверить тестовые случаи из запроса администратора и привести их к общему виду"""
+    if not isinstance(test_cases, list) or not test_cases:
+        raise ValueError('Для задачи с кодом нужен хотя бы один тестовый случай')
+
+    normalized = []
+    for case in test_cases:
+        if not isinstance(case, dict) or not isinstance(case.get('expected_output'), str):
+            raise ValueError('Каждый тестовый случай должен содержать ожидаемый вывод')
+        stdin = case.get('input', '')
+        if not isinstance(stdin, str):
+            raise ValueError('Входные данные тестового случая должны быть строкой')
+        normalized.append({'input': stdin, 'expected_output': case['expected_output']})
+    return normalized
+
+
+def normalize_output(text):
+    """Вывод сравниваем без пробелов в конце строк и пустых строк в конце"""
+    return '\n'.join(line.rstrip() for line in text.rstrip().splitlines())
+
+
+def case_status(case, expected):
+    """Итог одного тестового случая"""
+    if case is None:
+        return 'skipped'
+    if case['limit']:
+        return case['limit']
+    if case['returncode'] != 0:
+        return 'error'
+    if normalize_output(case['stdout']) != expected:
+        return 'wrong_answer'
+    return 'passed'
+
+
+def grade_code(pool, code, test_cases, stop_on_failure=False):
+    """Проверить решение на тестовых случаях.
+    Возвращает признак правильности, итоги по случаям и текст ошибки компиляции"""
+    if not isinstance(code, str) or not code.strip():
+        return {'is_correct': False, 'cases': [], 'error': None}
+
+    _, error = sandbox.check_syntax(code)
+    if error:
+        return {'is_correct': False, 'cases': [], 'error': error['formatted']}
+
+    expected = [normalize_output(case['expected_output']) for case in test_cases]
+    should_stop = None
+    if stop_on_failure:
+        should_stop = lambda case: case_status(case, expected[case['index']]) != 'passed'
+
+    try:
+        cases, _ = pool.run_cases(
+            code,
+            [case['input'] for case in test_cases],
+            current_app.config.get('COMPILER_CASE_TIMEOUT', DEFAULT_CASE_TIMEOUT),
+            current_app.config.get('COMPILER_GRADING_PARALLEL', os.cpu_count() or 1),
+            should_stop
+        )
+    except sandbox.ExecutionTimeout:
+        cases = [None] * len(test_cases)
+
+    # Входные данные и вывод скрытых случаев студенту не показываем
+    details = []
+    for index, case in enumerate(cases):
+        details.append({
+            'case': index + 1,
+            'status': case_status(case, expected[index]),
+            'duration_ms': case['duration_ms'] if case else None
+        })
+
+    return {
+        'is_correct': all(detail['status'] == 'passed' for detail in details),
+        'cases': details,
+        'error': None
+    }
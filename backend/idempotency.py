@@ -0,0 +1,77 @@
+"""
+Повторные отправки теста.
+Клиент передаёт с ответами ключ попытки, и если запрос повторяется (например,
+после тайм-аута на стороне браузера), вместо новой проверки и новой записи
+возвращается первый ответ. Недавние ответы хранятся в памяти процесса - это
+покрывает и результаты, которые ещё стоят в очереди отложенной записи, - а более
+старые читаются из базы, где ключ защищён уникальным ограничением
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_CACHE_SIZE = 10000  # ответов в памяти процесса
+WAIT_TIMEOUT = 60  # секунд ожидания первого запроса, пока он проверяет ответы
+MAX_KEY_LENGTH = 64
+
+
+class SubmissionInProgress(Exception):
+    """Первая отправка с тем же ключом ещё не завершилась"""
+
+
+_responses = OrderedDict()
+_in_progress = {}
+_lock = threading.Lock()
+
+
+def claim(scope):
+    """Закрепить ключ scope за вызывающим. Возвращает (ответ, токен):
+    ответ - сохранённый ответ, если отправка уже выполнена (токен тогда None);
+    иначе ключ закреплён за вызывающим, и он должен передать токен в complete или release"""
+    with _lock:
+        if scope in _responses:
+            _responses.move_to_end(scope)
+            return _responses[scope], None
+        event = _in_progress.get(scope)
+        if event is None:
+            token = _in_progress[scope] = threading.Event()
+            return None, token
+
+    # Тот же ключ сейчас проверяется в другом потоке: дожидаемся его ответа
+    if not event.wait(WAIT_TIMEOUT):
+        raise SubmissionInProgress()
+    return claim(scope)
+
+
+def complete(scope, response, token):
+    """Запомнить ответ для ключа и отпустить ожидающие запросы"""
+    cache_size = current_app.config.get('SUBMIT_IDEMPOTENCY_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    with _lock:
+        _responses[scope] = response
+        _responses.move_to_end(scope)
+        while len(_responses) > cache_size:
+            _responses.popitem(last=False)
+        _unlock(scope, token)
+
+
+def release(scope, token):
+    """Снять закрепление ключа без ответа (отправка завершилась ошибкой).
+    Чужое закрепление не снимается: token должен быть получен от claim"""
+    with _lock:
+        _unlock(scope, token)
+
+
+def submitted(scope):
+    """Отправлены ли ответы с ключом scope этим процессом (или проверяются сейчас)"""
+    with _lock:
+        return scope in _responses or scope in _in_progress
+
+
+def _unlock(scope, token):
+    """Снять закрепление, если оно принадлежит token (вызывается под _lock)"""
+    if token is not None and _in_progress.get(scope) is token:
+        del _in_progress[scope]
+        token.set()
@@ -0,0 +1,188 @@
+"""
+Анализ вопросов тестов.
+Для каждого вопроса хранятся суммы (question_stats и option_stats), которые
+обновляются в той же транзакции, что и сохранение результата, вычитаются
+при удалении результата и пересчитываются при смене правильного ответа вопроса.
+По суммам считаются трудность (доля верных ответов) и различающая способность
+(точечно-бисериальная корреляция правильности ответа с итоговым баллом), так что
+отчёт строится за O(число вопросов).
+Строки сумм одного теста общие для всех его отправок: параллельные отправки
+теста ждут друг друга на них до конца транзакции. Строки блокируются в порядке
+ключей, поэтому взаимной блокировки (deadlock) между отправками не бывает
+"""
+
+import math
+import operator
+from collections import defaultdict
+
+from models import db, OptionStats, QuestionStats, ResultAnswer, TestResult, upsert
+
+QUESTION_SUMS = ('attempts', 'correct', 'score_sum', 'score_sq_sum', 'correct_score_sum')
+OPTION_SUMS = ('count', 'score_sum')
+
+
+def record(entries, sign=1):
+    """Учесть ответы (sign=-1 - отменить учёт) в текущей транзакции.
+    entries - словари question_id, chosen, is_correct и score (доля баллов за тест, 0..1).
+    Ответы с неизвестной правильностью не учитываются"""
+    questions = defaultdict(lambda: dict.fromkeys(QUESTION_SUMS, 0))
+    options = defaultdict(lambda: dict.fromkeys(OPTION_SUMS, 0))
+    for entry in entries:
+        if entry['is_correct'] is None:
+            continue
+        score = entry['score']
+        sums = questions[entry['question_id']]
+        sums['attempts'] += sign
+        sums['score_sum'] += sign * score
+        sums['score_sq_sum'] += sign * score * score
+        if entry['is_correct']:
+            sums['correct'] += sign
+            sums['correct_score_sum'] += sign * score
+
+        option = options[(entry['question_id'], entry['chosen'] or '')]
+        option['count'] += sign
+        option['score_sum'] += sign * score
+
+    if questions:
+        add(QuestionStats, ['question_id'], QUESTION_SUMS, [
+            {'question_id': question_id, **sums} for question_id, sums in questions.items()
+        ])
+    if options:
+        add(OptionStats, ['question_id', 'chosen'], OPTION_SUMS, [
+            {'question_id': question_id, 'chosen': chosen, **sums}
+            for (question_id, chosen), sums in options.items()
+        ])
+
+
+def add(model, keys, sums, rows):
+    """Прибавить суммы rows к строкам model, создав недостающие (в порядке ключей, см. models.upsert)"""
+    upsert(model, keys, rows, dict.fromkeys(sums, operator.add))
+
+
+def retract_result(result_id):
+    """Отменить учёт ответов результата (перед его удалением или перепроверкой)"""
+    rows = db.session.execute(
+        db.select(ResultAnswer.question_id, ResultAnswer.chosen, ResultAnswer.is_correct, TestResult.percentage)
+        .join(TestResult, TestResult.id == ResultAnswer.result_id)
+        .where(ResultAnswer.result_id == result_id)
+    ).all()
+    record((
+        {'question_id': row.question_id, 'chosen': row.chosen, 'is_correct': row.is_correct,
+         'score': row.percentage / 100}
+        for row in rows
+    ), sign=-1)
+
+
+def regrade_question(question_id, correct_answer):
+    """Перепроверить сохранённые ответы на вопрос по новому правильному варианту
+    (в текущей транзакции): ответы, правильность которых меняется, вычитаются из сумм,
+    получают новое is_correct и учитываются снова. correct_answer=None - правильность
+    больше не известна (вопрос стал задачей с кодом). Баллы результатов не меняются.
+    Возвращает число перепроверенных ответов"""
+    if correct_answer is None:
+        is_correct = db.null()
+    else:
+        is_correct = db.func.coalesce(ResultAnswer.chosen == correct_answer, False)
+    changed = (ResultAnswer.question_id == question_id, ResultAnswer.is_correct.is_distinct_from(is_correct))
+    rows = db.session.execute(
+        db.select(ResultAnswer.chosen, ResultAnswer.is_correct, TestResult.percentage)
+        .join(TestResult, TestResult.id == ResultAnswer.result_id)
+        .where(*changed)
+    ).all()
+    if not rows:
+        return 0
+
+    record((
+        {'question_id': question_id, 'chosen': row.chosen, 'is_correct': row.is_correct,
+         'score': row.percentage / 100}
+        for row in rows
+    ), sign=-1)
+    db.session.execute(db.update(ResultAnswer).where(*changed).values(is_correct=is_correct))
+    record((
+        {'question_id': question_id, 'chosen': row.chosen,
+         'is_correct': None if correct_answer is None else row.chosen == correct_answer,
+         'score': row.percentage / 100}
+        for row in rows
+    ))
+    return len(rows)
+
+
+def rebuild():
+    """Пересчитать все суммы по result_answers (после переноса старых результатов)"""
+    db.session.execute(db.delete(QuestionStats))
+    db.session.execute(db.delete(OptionStats))
+
+    score = TestResult.percentage / 100.0
+    known = ResultAnswer.is_correct.is_not(None)
+    db.session.execute(db.insert(QuestionStats).from_select(
+        ['question_id', *QUESTION_SUMS],
+        db.select(
+            ResultAnswer.question_id,
+            db.func.count(),
+            db.func.count().filter(ResultAnswer.is_correct.is_(True)),
+            db.func.sum(score),
+            db.func.sum(score * score),
+            db.func.coalesce(db.func.sum(score).filter(ResultAnswer.is_correct.is_(True)), 0)
+        )
+        .join(TestResult, TestResult.id == ResultAnswer.result_id)
+        .where(known)
+        .group_by(ResultAnswer.question_id)
+    ))
+    chosen = db.func.coalesce(ResultAnswer.chosen, '')
+    db.session.execute(db.insert(OptionStats).from_select(
+        ['question_id', 'chosen', *OPTION_SUMS],
+        db.select(ResultAnswer.question_id, chosen, db.func.count(), db.func.sum(score))
+        .join(TestResult, TestResult.id == ResultAnswer.result_id)
+        .where(known)
+        .group_by(ResultAnswer.question_id, chosen)
+    ))
+
+
+def discrimination(stats):
+    """Точечно-бисериальная корреляция правильности ответа с баллом за тест или None"""
+    n, correct = stats.attempts, stats.correct
+    spread = (n * correct - correct * correct) * (n * stats.score_sq_sum - stats.score_sum ** 2)
+    if n < 2 or spread <= 1e-12:
+        return None
+    return round((n * stats.correct_score_sum - correct * stats.score_sum) / math.sqrt(spread), 3)
+
+
+def analyze(questions):
+    """Отчёт по вопросам (строки с id, question_text, question_type): трудность,
+    различающая способность и варианты ответа. Читаются только суммы этих вопросов"""
+    ids = [question.id for question in questions]
+    stats = {
+        row.question_id: row
+        for row in db.session.execute(db.select(QuestionStats).where(QuestionStats.question_id.in_(ids))).scalars()
+    }
+    options = defaultdict(list)
+    for row in db.session.execute(
+        db.select(OptionStats).where(OptionStats.question_id.in_(ids)).order_by(OptionStats.chosen)
+    ).scalars():
+        options[row.question_id].append(row)
+
+    report = []
+    for question in questions:
+        item = stats.get(question.id)
+        attempts = item.attempts if item else 0
+        report.append({
+            'question_id': question.id,
+            'question_text': question.question_text,
+            'question_type': question.question_type or 'choice',
+            'attempts': attempts,
+            'correct': item.correct if item else 0,
+            # Трудность (p-value): доля верных ответов
+            'p_value': round(item.correct / attempts, 3) if attempts else None,
+            'discrimination': discrimination(item) if item else None,
+            'options': [
+                {
+                    'chosen': option.chosen or None,
+                    'count': option.count,
+                    'share': round(option.count / attempts, 3) if attempts else None,
+                    # Средний балл выбравших: у дистрактора он должен быть ниже, чем у правильного ответа
+                    'mean_score': round(option.score_sum / option.count * 100, 1) if option.count else None
+                }
+                for option in options[question.id] if option.count
+            ] if question.question_type != 'code' else []
+        })
+    return report
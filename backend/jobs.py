@@ -0,0 +1,106 @@
+"""
+Асинхронная очередь заданий на выполнение кода.
+Веб-запрос только ставит задание в очередь, а выполняет его
+отдельный набор потоков с ограниченной параллельностью
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_MAX_CONCURRENT_JOBS = 4
+DEFAULT_MAX_QUEUED_JOBS = 100
+DEFAULT_JOB_TTL = 300  # сколько секунд хранить завершённые задания
+
+
+class QueueFull(Exception):
+    """В очереди нет места для нового задания"""
+
+
+class JobQueue:
+    """Очередь заданий с ограничением на число одновременно выполняемых"""
+
+    def __init__(self, max_concurrent, max_queued, ttl):
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='compiler-job')
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """Поставить задание в очередь и вернуть его идентификатор"""
+        with self._lock:
+            self._prune()
+            if self._pending >= self.max_queued:
+                raise QueueFull()
+            job = {
+                'id': uuid.uuid4().hex,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None
+            }
+            self._jobs[job['id']] = job
+            self._pending += 1
+
+        self._executor.submit(self._run, job, func, args)
+        return job['id']
+
+    def _run(self, job, func, args):
+        """Выполнить задание в потоке очереди"""
+        with self._lock:
+            job['started_at'] = time.time()
+            job['status'] = 'running'
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = {
+                'success': False,
+                'error': f'Ошибка выполнения: {str(e)}'
+            }
+
+        with self._lock:
+            job['result'] = result
+            job['finished_at'] = time.time()
+            job['status'] = 'finished'
+            self._pending -= 1
+
+    def _prune(self):
+        """Удалить завершённые задания, срок хранения которых истёк"""
+        expired_before = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and job['finished_at'] < expired_before
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Получить копию задания по идентификатору"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Получить очередь процесса, создав её при первом обращении"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                current_app.config.get('COMPILER_MAX_CONCURRENT_JOBS', DEFAULT_MAX_CONCURRENT_JOBS),
+                current_app.config.get('COMPILER_MAX_QUEUED_JOBS', DEFAULT_MAX_QUEUED_JOBS),
+                current_app.config.get('COMPILER_JOB_TTL', DEFAULT_JOB_TTL)
+            )
+    return _queue
@@ -0,0 +1,318 @@
+"""
+Таблицы лидеров тестов.
+Для каждого теста в памяти хранится упорядоченный индекс лучших результатов
+студентов (по проценту по убыванию, затем по времени по возрастанию). Индекс
+загружается из базы при первом обращении и дальше дополняется: новыми отправками
+этого процесса сразу и результатами других процессов сервера раз в
+LEADERBOARD_REFRESH_INTERVAL секунд. При дочитывании читаются результаты, завершённые
+не раньше LEADERBOARD_REFRESH_OVERLAP секунд до последнего прочитанного: в PostgreSQL
+результат может зафиксироваться позже записанных после него, а повторно прочитанные
+строки ничего не меняют. Удалённые в других процессах результаты пропадают из
+таблицы при полной перезагрузке раз в LEADERBOARD_REBUILD_INTERVAL секунд; пока она
+идёт, запросы отвечают по прежней таблице.
+Вставка, удаление и место студента - O(log n) на списке с пропусками (skiplist).
+Студент определяется владельцем попытки (пользователь или браузер), а не именем:
+одноимённые студенты не затирают результаты друг друга
+"""
+
+import logging
+import random
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+
+import result_writer
+from models import ANONYMOUS_STUDENT, db, TestResult
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_REFRESH_INTERVAL = 60
+DEFAULT_REFRESH_OVERLAP = 300
+DEFAULT_REBUILD_INTERVAL = 600
+# Уровней в списке с пропусками: хватает на миллионы записей
+MAX_LEVELS = 24
+
+logger = logging.getLogger(__name__)
+
+
+class _Last:
+    """Ключ конца списка: больше любого другого ключа"""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        # width[level] - сколько элементов нижнего уровня перескакивает ссылка next[level]
+        self.width = [1] * levels
+
+
+class RankIndex:
+    """Упорядоченное множество различных ключей (индексируемый список с пропусками):
+    вставка, удаление и номер ключа за O(log n) в среднем"""
+
+    def __init__(self):
+        self._end = _Node(_Last(), 0)
+        self._head = _Node(None, MAX_LEVELS)
+        self._head.next = [self._end] * MAX_LEVELS
+        self._levels = 1  # уровней, на которых уже есть узлы
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _chain(self, key):
+        """Последний узел с ключом меньше key на каждом уровне и позиция узла"""
+        chain = [self._head] * MAX_LEVELS
+        positions = [0] * MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._chain(key)
+        levels = 1
+        while levels < MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        for level in range(self._levels, levels):
+            # Новый уровень: ссылка из начала в конец перескакивает все элементы
+            self._head.width[level] = self._size + 1
+        self._levels = max(self._levels, levels)
+        node = _Node(key, levels)
+        for level in range(levels):
+            previous = chain[level]
+            # Сколько элементов между previous и новым узлом на этом уровне
+            skipped = positions[0] - positions[level]
+            node.next[level] = previous.next[level]
+            node.width[level] = previous.width[level] - skipped
+            previous.next[level] = node
+            previous.width[level] = skipped + 1
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._chain(key)
+        node = chain[0].next[0]
+        if node is self._end or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def position(self, key):
+        """Номер ключа с единицы (ключ должен быть в индексе)"""
+        _, positions = self._chain(key)
+        return positions[0] + 1
+
+    def first(self, limit):
+        """Первые limit ключей"""
+        keys = []
+        node = self._head.next[0]
+        while node is not self._end and len(keys) < limit:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def result_owner(owner, student_name):
+    """Чей результат: владелец попытки, а у старых результатов без владельца - имя"""
+    return owner or f'name:{student_name}'
+
+
+class Leaderboard:
+    """Лучший результат каждого студента в порядке мест"""
+
+    def __init__(self):
+        self.seen_at = None  # самое позднее завершение среди результатов, прочитанных из базы
+        self.loaded_at = self.refreshed_at = time.monotonic()
+        self._index = RankIndex()
+        self._best = {}  # владелец -> (ключ, имя студента, время прохождения)
+
+    def add(self, owner, student_name, percentage, time_taken, completed_at):
+        """Учесть результат; место меняется, только если он лучше прежнего результата студента"""
+        owner = result_owner(owner, student_name)
+        try:
+            time_taken = int(time_taken or 0)
+        except (TypeError, ValueError):
+            time_taken = 0  # время присылает браузер, в старых результатах оно может быть любым
+        key = (-percentage, time_taken, completed_at.timestamp() if completed_at else 0, owner)
+        previous = self._best.get(owner)
+        if previous is not None:
+            if previous[0] <= key:
+                return
+            self._index.remove(previous[0])
+        self._index.insert(key)
+        self._best[owner] = (key, student_name, completed_at)
+
+    def add_rows(self, rows):
+        """Учесть строки результатов из базы"""
+        for row in rows:
+            self.add(row.owner, row.student_name, row.percentage, row.time_taken, row.completed_at)
+            if row.completed_at and (self.seen_at is None or row.completed_at > self.seen_at):
+                self.seen_at = row.completed_at
+
+    def __len__(self):
+        return len(self._index)
+
+    def top(self, limit):
+        """Первые limit мест"""
+        return [self._entry(rank, key) for rank, key in enumerate(self._index.first(limit), start=1)]
+
+    def rank(self, owner):
+        """Место студента или None, если у него нет результатов"""
+        previous = self._best.get(owner)
+        if previous is None:
+            return None
+        return self._entry(self._index.position(previous[0]), previous[0])
+
+    def _entry(self, rank, key):
+        _, student_name, completed_at = self._best[key[3]]
+        return {
+            'rank': rank,
+            'student_name': student_name,
+            'percentage': round(-key[0], 2),
+            'time_taken': key[1],
+            'completed_at': completed_at.isoformat() if completed_at else None
+        }
+
+
+_boards = {}
+# Результаты, отправленные, пока таблица теста загружается из базы
+_journals = {}
+_load_locks = {}
+# Защищает только структуры в памяти: запросы к базе выполняются без неё
+_lock = threading.Lock()
+
+
+def select_results(test_id, since=None):
+    """Запрос результатов теста, завершённых не раньше since (без анонимных)"""
+    query = db.select(
+        TestResult.owner, TestResult.student_name, TestResult.percentage,
+        TestResult.time_taken, TestResult.completed_at
+    ).where(TestResult.test_id == test_id, TestResult.student_name != ANONYMOUS_STUDENT)
+    if since is not None:
+        query = query.where(TestResult.completed_at >= since)
+    return db.session.execute(query).all()
+
+
+def load(test_id):
+    """Построить таблицу лидеров теста по базе и очереди отложенной записи"""
+    board = Leaderboard()
+    board.add_rows(select_results(test_id))
+    # Результаты, которые ещё ждут записи в базу
+    for row in result_writer.pending(test_id):
+        if row['student_name'] != ANONYMOUS_STUDENT:
+            board.add(row.get('owner'), row['student_name'], row['percentage'], row['time_taken'],
+                      row['completed_at'])
+    return board
+
+
+def get_leaderboard(test_id):
+    """Таблица лидеров теста: загружается при первом обращении, потом дополняется новыми
+    результатами и время от времени перезагружается целиком"""
+    config = current_app.config
+    with _lock:
+        board = _boards.get(test_id)
+        load_lock = _load_locks.setdefault(test_id, threading.Lock())
+    if board is None:
+        return _load_board(test_id, load_lock)
+
+    now = time.monotonic()
+    with _lock:
+        # Перезагружает и дочитывает один запрос, остальные пока отвечают по текущей таблице
+        rebuild = now - board.loaded_at > config.get('LEADERBOARD_REBUILD_INTERVAL', DEFAULT_REBUILD_INTERVAL)
+        refresh = now - board.refreshed_at > config.get('LEADERBOARD_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+        if rebuild:
+            board.loaded_at = now
+        elif refresh:
+            board.refreshed_at = now
+            since = board.seen_at
+    if rebuild:
+        try:
+            return _load_board(test_id, load_lock, board)
+        except Exception:
+            # Прежняя таблица лучше ошибки: попробуем перезагрузить её в следующий раз
+            logger.exception('Не удалось перезагрузить таблицу лидеров теста %s', test_id)
+            return board
+    if refresh:
+        if since is not None:
+            since -= timedelta(seconds=config.get('LEADERBOARD_REFRESH_OVERLAP', DEFAULT_REFRESH_OVERLAP))
+        rows = select_results(test_id, since)
+        with _lock:
+            board.add_rows(rows)
+    return board
+
+
+def _load_board(test_id, load_lock, current=None):
+    """Загрузить таблицу (взамен current) без общей блокировки: отправки тем временем
+    пишутся в журнал и учитываются в новой таблице"""
+    with load_lock:
+        with _lock:
+            board = _boards.get(test_id)
+            if board is not None and board is not current:
+                return board  # пока ждали, таблицу загрузил другой запрос
+            _journals[test_id] = []
+        try:
+            board = load(test_id)
+        except Exception:
+            with _lock:
+                _journals.pop(test_id, None)
+            raise
+        with _lock:
+            journal = _journals.pop(test_id, None)
+            if journal is not None:  # None - таблицу сбросили во время загрузки
+                for entry in journal:
+                    board.add(*entry)
+                _boards[test_id] = board
+        return board
+
+
+def query(test_id, limit, owner=None):
+    """Первые limit мест, число участников и место студента"""
+    board = get_leaderboard(test_id)
+    with _lock:
+        return {
+            'total': len(board),
+            'top': board.top(limit),
+            'student': board.rank(owner) if owner else None
+        }
+
+
+def record(test_id, owner, student_name, percentage, time_taken, completed_at):
+    """Учесть новый результат в загруженной таблице (незагруженная прочитает его из базы)"""
+    if student_name == ANONYMOUS_STUDENT:
+        return
+    entry = (owner, student_name, percentage, time_taken, completed_at)
+    with _lock:
+        board = _boards.get(test_id)
+        if board is not None:
+            board.add(*entry)
+        if test_id in _journals:
+            # Таблица загружается или перезагружается: учтём результат и в новой
+            _journals[test_id].append(entry)
+
+
+def invalidate(test_id):
+    """Сбросить таблицу теста (после удаления результата): следующий запрос перечитает её"""
+    with _lock:
+        _boards.pop(test_id, None)
+        _journals.pop(test_id, None)
@@ -1,14 +1,85 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
 from flask import current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# Варианты ответа на вопрос с выбором
+ANSWER_OPTIONS = ('A', 'B', 'C', 'D')
+# Имя студента, не указавшего имя при отправке теста
+ANONYMOUS_STUDENT = 'Анонимный студент'
+
 def init_db(app):
     """Инициализация базы данных с приложением Flask"""
     db.init_app(app)
 
+def upgrade_schema():
+    """Добавить в существующие таблицы столбцы и индексы, появившиеся в моделях.
+    db.create_all() создаёт только новые таблицы, поэтому остальное добавляем сами"""
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+                preparer.quote(table.name),
+                preparer.quote(column.name),
+                column.type.compile(dialect=db.engine.dialect)
+            )
+            if column.server_default is not None:
+                ddl += f" DEFAULT '{column.server_default.arg}'"
+            db.session.execute(db.text(ddl))
+        
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.session.connection())
+    
+    db.session.commit()
+
+def upsert(model, keys, rows, update, where=None):
+    """Вставить строки rows в model, а строки с теми же keys обновить.
+    update - {столбец: f(текущее значение, новое значение)} для обновления,
+    where - {столбец: f(текущее, новое)} - условия, при которых строку обновлять.
+    В PostgreSQL и SQLite - один запрос INSERT ... ON CONFLICT на всю пачку.
+    Строки идут в порядке ключей: две транзакции блокируют общие строки в одном порядке"""
+    where = where or {}
+    rows = sorted(rows, key=lambda row: tuple(row[name] for name in keys))
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        # Другие базы: обновляем по строке и вставляем, если строки ещё нет
+        for row in rows:
+            key = [getattr(model, name) == row[name] for name in keys]
+            conditions = [f(getattr(model, name), row[name]) for name, f in where.items()]
+            updated = db.session.execute(
+                db.update(model).where(*key, *conditions)
+                .values({name: f(getattr(model, name), row[name]) for name, f in update.items()})
+            )
+            if not updated.rowcount and not db.session.execute(db.select(db.exists().where(*key))).scalar():
+                db.session.execute(db.insert(model), [row])
+        return
+    
+    statement = insert(model)
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: f(getattr(model, name), getattr(statement.excluded, name)) for name, f in update.items()},
+        where=db.and_(*(
+            f(getattr(model, name), getattr(statement.excluded, name)) for name, f in where.items()
+        )) if where else None
+    )
+    db.session.execute(statement, rows)
+
 class User(db.Model):
     """Модель для пользователей"""
     __tablename__ = 'users'
@@ -73,6 +144,12 @@ class Test(db.Model):
     passing_score = db.Column(db.Integer, default=70)  # в процентах
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Версия содержимого: растёт при каждом изменении вопросов, из неё строится ETag
+    version = db.Column(db.Integer, default=1, server_default='1')
+    # Случайный вариант: сколько вопросов выдавать за попытку (None - все вопросы теста)
+    pool_size = db.Column(db.Integer)
+    # Банк вопросов варианта: только вопросы с этой меткой (None - все вопросы теста)
+    pool_tag = db.Column(db.String(50))
     
     # Связь с вопросами
     questions = db.relationship('Question', backref='test', lazy=True, cascade='all, delete-orphan')
@@ -87,16 +164,29 @@ class Test(db.Model):
             'time_limit': self.time_limit,
             'passing_score': self.passing_score,
             'is_active': self.is_active,
-            'questions_count': len(self.questions),
+            'questions_count': self.questions_count,
+            'pool_size': self.pool_size,
+            'pool_tag': self.pool_tag,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+    
+    @staticmethod
+    def bump_version(test_id):
+        """Отметить изменение содержимого теста (в текущей транзакции)"""
+        db.session.execute(
+            db.update(Test).where(Test.id == test_id).values(version=db.func.coalesce(Test.version, 1) + 1)
+        )
 
 class Question(db.Model):
     """Модель для вопросов тестов"""
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Банк вопросов теста с отбором по метке
+        db.Index('ix_questions_test_id_tag', 'test_id', 'tag'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False, index=True)
     question_text = db.Column(db.Text, nullable=False)
     option_a = db.Column(db.String(500))
     option_b = db.Column(db.String(500))
@@ -105,9 +195,39 @@ class Question(db.Model):
     correct_answer = db.Column(db.String(1), nullable=False)  # 'A', 'B', 'C', 'D'
     explanation = db.Column(db.Text)
     order = db.Column(db.Integer, default=0)
+    # Тип вопроса: 'choice' - выбор варианта, 'code' - задача с автопроверкой кода
+    question_type = db.Column(db.String(20), default='choice', server_default='choice')
+    test_cases = db.Column(db.Text)  # JSON список {'input': ..., 'expected_output': ...}
+    stop_on_failure = db.Column(db.Boolean, default=False)  # прекращать проверку после первой ошибки
+    tag = db.Column(db.String(50))  # метка для банка вопросов (тема, сложность)
     
-    def to_dict(self):
-        return {
+    @property
+    def is_code(self):
+        return self.question_type == 'code'
+    
+    def get_test_cases(self):
+        """Тестовые случаи задачи с кодом"""
+        return json.loads(self.test_cases) if self.test_cases else []
+    
+    def to_student_dict(self):
+        """Вопрос для прохождения теста: без правильного ответа, пояснения и тестовых случаев"""
+        data = {
+            'id': self.id,
+            'test_id': self.test_id,
+            'question_text': self.question_text,
+            'option_a': self.option_a,
+            'option_b': self.option_b,
+            'option_c': self.option_c,
+            'option_d': self.option_d,
+            'order': self.order,
+            'question_type': self.question_type or 'choice'
+        }
+        if self.is_code:
+            data['test_cases_count'] = len(self.get_test_cases())
+        return data
+    
+    def to_dict(self, include_test_cases=False):
+        data = {
             'id': self.id,
             'test_id': self.test_id,
             'question_text': self.question_text,
@@ -117,25 +237,53 @@ class Question(db.Model):
             'option_d': self.option_d,
             'correct_answer': self.correct_answer,
             'explanation': self.explanation,
-            'order': self.order
+            'order': self.order,
+            'question_type': self.question_type or 'choice',
+            'tag': self.tag
         }
+        if self.is_code:
+            # Сами тестовые случаи скрыты от студентов
+            data['test_cases_count'] = len(self.get_test_cases())
+            data['stop_on_failure'] = bool(self.stop_on_failure)
+            if include_test_cases:
+                data['test_cases'] = self.get_test_cases()
+        return data
+
+# Число вопросов считается подзапросом в том же SELECT, что и сам тест,
+# поэтому to_dict не подгружает вопросы и список тестов читается одним запросом
+Test.questions_count = db.column_property(
+    db.select(db.func.count(Question.id))
+    .where(Question.test_id == Test.id)
+    .correlate_except(Question)
+    .scalar_subquery()
+)
 
 class TestResult(db.Model):
     """Модель для результатов тестов"""
     __tablename__ = 'test_results'
+    __table_args__ = (
+        # Постраничная выдача результатов теста по дате прохождения
+        db.Index('ix_test_results_test_id_completed_at', 'test_id', 'completed_at'),
+        # Одна запись на ключ попытки: повторная отправка не создаёт дубликат
+        db.Index('uq_test_results_test_id_idempotency_key', 'test_id', 'idempotency_key', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
     student_name = db.Column(db.String(100), nullable=False)
+    owner = db.Column(db.String(64))  # кто отправил: вошедший пользователь или браузер (по cookie сессии)
     score = db.Column(db.Integer, nullable=False)  # количество правильных ответов
     total_questions = db.Column(db.Integer, nullable=False)
     percentage = db.Column(db.Float, nullable=False)
     time_taken = db.Column(db.Integer)  # в секундах
     answers = db.Column(db.Text)  # JSON строка с ответами
+    seed = db.Column(db.Integer)  # номер случайного варианта, по нему восстанавливается набор вопросов
+    idempotency_key = db.Column(db.String(64))  # ключ попытки от клиента
+    response_data = db.deferred(db.Column(db.Text))  # JSON первого ответа, для повторных отправок
     completed_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, include_answers=True):
+        data = {
             'id': self.id,
             'test_id': self.test_id,
             'student_name': self.student_name,
@@ -143,6 +291,60 @@ class TestResult(db.Model):
             'total_questions': self.total_questions,
             'percentage': self.percentage,
             'time_taken': self.time_taken,
-            'answers': self.answers,
+            'seed': self.seed,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
         }
+        if include_answers:
+            data['answers'] = self.answers
+        return data
+
+class ResultAnswer(db.Model):
+    """Ответ на один вопрос в результате теста: для статистики по вопросам запросами SQL"""
+    __tablename__ = 'result_answers'
+    __table_args__ = (
+        # Распределение ответов на вопрос: сколько выбрали каждый вариант и сколько ответили верно
+        db.Index('ix_result_answers_question_id_chosen', 'question_id', 'chosen', 'is_correct'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    result_id = db.Column(db.Integer, db.ForeignKey('test_results.id'), nullable=False, index=True)
+    # Без внешнего ключа: статистика переживает удаление вопроса
+    question_id = db.Column(db.Integer, nullable=False)
+    chosen = db.Column(db.String(1))  # выбранный вариант 'A'-'D'; None - нет ответа или задача с кодом
+    is_correct = db.Column(db.Boolean)  # None - правильность неизвестна (перенесено из старых результатов)
+
+class QuestionStats(db.Model):
+    """Накопленные суммы для анализа вопроса: обновляются при каждом результате,
+    поэтому трудность и различающая способность считаются без просмотра результатов"""
+    __tablename__ = 'question_stats'
+    
+    question_id = db.Column(db.Integer, primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # ответов с известной правильностью
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0)  # сумма долей набранных баллов за тест
+    score_sq_sum = db.Column(db.Float, nullable=False, default=0)
+    correct_score_sum = db.Column(db.Float, nullable=False, default=0)  # то же, только у ответивших верно
+
+class OptionStats(db.Model):
+    """Накопленные суммы по варианту ответа на вопрос"""
+    __tablename__ = 'option_stats'
+    
+    question_id = db.Column(db.Integer, primary_key=True)
+    chosen = db.Column(db.String(1), primary_key=True)  # '' - вопрос без ответа
+    count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0)
+
+class TestDraft(db.Model):
+    """Черновик ответов на тест, сохраняемый во время прохождения"""
+    __tablename__ = 'test_drafts'
+    __table_args__ = (
+        # Один черновик на владельца и тест
+        db.Index('uq_test_drafts_test_id_owner', 'test_id', 'owner', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    owner = db.Column(db.String(64), nullable=False)  # пользователь или браузер
+    data = db.Column(db.Text, nullable=False)  # JSON: ответы и ключ попытки
+    seed = db.Column(db.Integer)  # выданный сервером вариант незавершённой попытки (тест со случайным вариантом)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,170 @@
+"""
+Массовый импорт вопросов в тест из CSV или NDJSON.
+Тело запроса читается потоком по строкам, каждая строка проверяется сразу,
+а вопросы вставляются пачками многострочным INSERT в одной транзакции.
+Память не зависит от размера файла: в ней только текущая пачка и первые ошибки
+"""
+
+import csv
+import io
+import json
+
+from grading import validate_test_cases
+from models import ANSWER_OPTIONS, db, Question
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = 500  # вопросов в одном INSERT
+MAX_REPORTED_ERRORS = 100  # остальные ошибки только считаются
+
+# Ограничения длины столбцов вопроса: строку с более длинным значением отклоняем сразу,
+# иначе ошибка базы прервала бы всю транзакцию импорта
+OPTION_MAX_LENGTH = 500
+TAG_MAX_LENGTH = 50
+TRUE_VALUES = ('1', 'true', 'yes', 'да')
+
+
+def detect_format(requested, mimetype):
+    """Формат импорта из параметра format или типа содержимого запроса"""
+    if requested:
+        import_format = requested.lower()
+    elif mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json'):
+        import_format = 'ndjson'
+    else:
+        import_format = 'csv'
+    if import_format not in IMPORT_FORMATS:
+        raise ValueError('Формат импорта должен быть csv или ndjson')
+    return import_format
+
+
+def read_rows(stream, import_format):
+    """Строки файла по одной: (номер строки, словарь полей или ValueError)"""
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8-sig', newline='')
+    if import_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Лишние столбцы без заголовка csv складывает под ключ None
+            yield reader.line_num, {key: value for key, value in row.items() if key is not None}
+        return
+
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, ValueError('Строка не является корректным JSON')
+            continue
+        if not isinstance(row, dict):
+            yield line_number, ValueError('Строка должна быть JSON-объектом')
+            continue
+        yield line_number, row
+
+
+def text_field(row, name, max_length=None):
+    value = row.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        value = str(value)
+    if max_length is not None and len(value) > max_length:
+        raise ValueError(f'Поле {name} длиннее {max_length} символов')
+    return value
+
+
+def flag_field(row, name):
+    value = row.get(name)
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def question_values(row, test_id, default_order):
+    """Проверить строку файла и вернуть значения столбцов вопроса"""
+    question_text = text_field(row, 'question_text').strip()
+    if not question_text:
+        raise ValueError('Текст вопроса обязателен')
+
+    is_code = text_field(row, 'question_type').strip().lower() == 'code'
+    correct_answer = ''
+    test_cases = None
+    if is_code:
+        test_cases = row.get('test_cases')
+        if isinstance(test_cases, str):
+            # В CSV тестовые случаи передаются JSON-строкой
+            try:
+                test_cases = json.loads(test_cases) if test_cases.strip() else None
+            except ValueError:
+                raise ValueError('Тестовые случаи должны быть JSON-списком')
+        test_cases = json.dumps(validate_test_cases(test_cases))
+    else:
+        correct_answer = text_field(row, 'correct_answer').strip().upper()
+        if correct_answer not in ANSWER_OPTIONS:
+            raise ValueError('Правильный ответ должен быть одной из букв A, B, C, D')
+
+    order = row.get('order')
+    if order is None or order == '':
+        order = default_order
+    else:
+        try:
+            order = int(order)
+        except (TypeError, ValueError):
+            raise ValueError('Порядок вопроса должен быть целым числом')
+
+    return {
+        'test_id': test_id,
+        'question_text': question_text,
+        'option_a': text_field(row, 'option_a', OPTION_MAX_LENGTH),
+        'option_b': text_field(row, 'option_b', OPTION_MAX_LENGTH),
+        'option_c': text_field(row, 'option_c', OPTION_MAX_LENGTH),
+        'option_d': text_field(row, 'option_d', OPTION_MAX_LENGTH),
+        'correct_answer': correct_answer,
+        'explanation': text_field(row, 'explanation'),
+        'order': order,
+        'question_type': 'code' if is_code else 'choice',
+        'test_cases': test_cases,
+        'stop_on_failure': flag_field(row, 'stop_on_failure'),
+        'tag': text_field(row, 'tag', TAG_MAX_LENGTH).strip() or None
+    }
+
+
+def import_questions(test_id, rows):
+    """Добавить вопросы из rows (результат read_rows) в текущую транзакцию.
+    Вопросы без порядка получают номера после последнего вопроса теста.
+    Возвращает отчёт: сколько добавлено, сколько строк с ошибками и первые ошибки"""
+    last_order = db.session.execute(
+        db.select(db.func.max(Question.order)).where(Question.test_id == test_id)
+    ).scalar()
+    next_order = 0 if last_order is None else last_order + 1
+
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+    for line_number, row in rows:
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            values = question_values(row, test_id, next_order)
+        except ValueError as e:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': line_number, 'error': str(e)})
+            continue
+
+        next_order = max(next_order, values['order'] + 1)
+        batch.append(values)
+        if len(batch) >= BATCH_SIZE:
+            db.session.execute(db.insert(Question), batch)
+            imported += len(batch)
+            batch = []
+
+    if batch:
+        db.session.execute(db.insert(Question), batch)
+        imported += len(batch)
+
+    return {
+        'imported': imported,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors)
+    }
@@ -0,0 +1,148 @@
+"""
+Кэш результатов выполнения детерминированного кода.
+Ключ строится по нормализованному коду, stdin и версии интерпретатора,
+поэтому повторный запуск примеров из лекций не требует нового процесса
+"""
+
+import ast
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_MAX_CACHED_OUTPUT = 64 * 1024
+
+# Модули без побочных эффектов: их вывод зависит только от кода
+PURE_MODULES = {
+    'abc', 'array', 'bisect', 'cmath', 'collections', 'copy', 'dataclasses',
+    'decimal', 'enum', 'fractions', 'functools', 'heapq', 'itertools', 'json',
+    'keyword', 'math', 'numbers', 'operator', 'pprint', 're', 'statistics',
+    'string', 'textwrap', 'typing'
+}
+
+# Встроенные функции, результат которых зависит от окружения или запуска:
+# ввод, файлы, динамический код, адреса объектов и порядок обхода множеств
+IMPURE_NAMES = {
+    '__builtins__', '__import__', 'breakpoint', 'compile', 'eval', 'exec',
+    'frozenset', 'globals', 'hash', 'help', 'id', 'input', 'locals', 'open',
+    'set', 'vars'
+}
+
+# Атрибуты, через которые можно добраться до произвольных модулей
+IMPURE_ATTRIBUTES = {
+    '__builtins__', '__code__', '__globals__', '__import__', '__loader__',
+    '__subclasses__'
+}
+
+
+def is_deterministic(tree):
+    """Проверить по AST, что вывод кода не зависит от времени, случайности, ввода, файлов и сети"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split('.')[0] not in PURE_MODULES for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or (node.module or '').split('.')[0] not in PURE_MODULES:
+                return False
+        elif isinstance(node, ast.Name) and node.id in IMPURE_NAMES:
+            return False
+        elif isinstance(node, ast.Attribute) and node.attr in IMPURE_ATTRIBUTES:
+            return False
+        elif isinstance(node, (ast.Set, ast.SetComp)):
+            return False
+    return True
+
+
+def normalize(code):
+    """Привести код к каноническому виду, не меняя его смысла и номеров строк"""
+    return code.replace('\r\n', '\n').replace('\r', '\n').rstrip()
+
+
+def cache_key(code, tree, stdin=''):
+    """Ключ кэша для кода (по его уже разобранному дереву) или None, если код нельзя кэшировать"""
+    if tree is None or not is_deterministic(tree):
+        return None
+
+    code = normalize(code)
+    digest = hashlib.sha256()
+    for part in (sys.version, stdin, code):
+        digest.update(part.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU-кэш результатов с ограниченным временем жизни записей"""
+
+    def __init__(self, max_entries, ttl, max_output):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_output = max_output
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Получить результат по ключу или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        """Сохранить результат, если он завершился штатно, без превышения лимитов и не слишком велик"""
+        if result['limit'] or result['returncode'] is None or result['returncode'] < 0:
+            return
+        if len(result['stdout']) + len(result['stderr']) > self.max_output:
+            return
+        # Представления объектов с адресами в памяти меняются от запуска к запуску
+        if ' at 0x' in result['stdout'] or ' at 0x' in result['stderr']:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Счётчики попаданий и промахов"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Получить кэш процесса, создав его при первом обращении"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                current_app.config.get('COMPILER_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+                current_app.config.get('COMPILER_CACHE_TTL', DEFAULT_CACHE_TTL),
+                current_app.config.get('COMPILER_MAX_CACHED_OUTPUT', DEFAULT_MAX_CACHED_OUTPUT)
+            )
+    return _cache
@@ -0,0 +1,257 @@
+"""
+Отложенная запись результатов тестов.
+Во время экзамена каждая отправка теста - отдельная транзакция с удалённой базой.
+В режиме отложенной записи студент сразу получает оценку, а результаты копятся
+в очереди и сохраняются пачками одним многострочным INSERT - по размеру пачки
+или по таймеру. При остановке сервера очередь сбрасывается в базу, а если база
+недоступна - в файл, который загружается при следующем запуске
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+import item_analysis
+from models import db, ResultAnswer, TestResult
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0  # секунд между сбросами неполной пачки
+DEFAULT_MAX_PENDING = 10000  # больше результатов в очереди не держим, пишем сразу
+SPOOL_FILE_NAME = 'pending_results.jsonl'
+
+logger = logging.getLogger(__name__)
+
+
+class ResultWriter:
+    """Очередь результатов и фоновый поток, сохраняющий их пачками"""
+
+    def __init__(self, app, batch_size, flush_interval, max_pending, spool_path):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spool_path = spool_path
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.duplicates = 0
+        self.last_flush_at = None
+        self.last_error = None
+        self._pending = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+
+        self._load_spool()
+        self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def enqueue(self, row):
+        """Поставить результат в очередь; False, если очередь переполнена"""
+        with self._condition:
+            if self._stopped or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def flush(self):
+        """Сохранить все результаты из очереди; False, если база недоступна"""
+        with self._flush_lock:
+            with self._condition:
+                rows, self._pending = self._pending, []
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    with self.app.app_context():
+                        inserted = self._insert(batch)
+                except Exception as e:
+                    logger.exception('Не удалось сохранить пачку результатов тестов')
+                    with self._condition:
+                        # Несохранённые результаты возвращаем в начало очереди
+                        self._pending[:0] = rows[start:]
+                        self.failures += 1
+                        self.last_error = str(e)
+                    return False
+                with self._condition:
+                    self.written += inserted
+                    self.batches += 1
+                    self.last_flush_at = time.time()
+            return True
+
+    def pending(self, test_id):
+        """Результаты теста, ещё не сохранённые в базу"""
+        with self._condition:
+            return [row for row in self._pending if row['test_id'] == test_id]
+
+    def stats(self):
+        """Глубина очереди и счётчики записи"""
+        with self._condition:
+            return {
+                'enabled': True,
+                'queue_depth': len(self._pending),
+                'max_pending': self.max_pending,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'written': self.written,
+                'batches': self.batches,
+                'failures': self.failures,
+                'duplicates': self.duplicates,
+                'last_flush_at': self.last_flush_at,
+                'last_error': self.last_error
+            }
+
+    def shutdown(self):
+        """Остановить поток и сохранить очередь: в базу, а если не вышло - в файл"""
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+        if not self.flush() and self.spool_path:
+            self._write_spool()
+
+    def _insert(self, batch):
+        """Сохранить пачку и вернуть число сохранённых строк.
+        Если в пачке повтор уже сохранённой отправки, строки сохраняются по одной без него"""
+        try:
+            insert_results(batch)
+            db.session.commit()
+            return len(batch)
+        except IntegrityError:
+            db.session.rollback()
+
+        inserted = 0
+        for row in batch:
+            try:
+                insert_results([row])
+                db.session.commit()
+                inserted += 1
+            except IntegrityError:
+                # Ту же отправку уже сохранил другой процесс сервера
+                db.session.rollback()
+                with self._condition:
+                    self.duplicates += 1
+        return inserted
+
+    def _run(self):
+        """Фоновый поток: сбрасывать очередь по заполнению пачки или по таймеру"""
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                if self._stopped:
+                    return
+            if not self.flush():
+                # База недоступна: повторим после паузы, а не в цикле
+                with self._condition:
+                    self._condition.wait(self.flush_interval)
+
+    def _write_spool(self):
+        """Дописать несохранённые результаты в файл"""
+        with self._condition:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+        with open(self.spool_path, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps({**row, 'completed_at': row['completed_at'].isoformat()}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        logger.warning('Результаты тестов (%d) сохранены в %s до следующего запуска', len(rows), self.spool_path)
+
+    def _load_spool(self):
+        """Вернуть в очередь результаты, сохранённые в файл при прошлой остановке"""
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            row['completed_at'] = datetime.fromisoformat(row['completed_at'])
+        self._pending.extend(rows)
+        # Файл удаляем только после того, как результаты попали в базу
+        if self.flush():
+            os.remove(self.spool_path)
+        else:
+            with self._condition:
+                self._pending.clear()
+
+
+def insert_results(rows):
+    """Вставить результаты вместе с ответами по вопросам (ключ answer_rows каждой строки)
+    в текущую транзакцию и вернуть id результатов"""
+    result_rows = [{key: value for key, value in row.items() if key != 'answer_rows'} for row in rows]
+    # sort_by_parameter_order: id возвращаются в порядке строк, даже если INSERT разбит на части
+    result_ids = db.session.execute(
+        db.insert(TestResult).returning(TestResult.id, sort_by_parameter_order=True), result_rows
+    ).scalars().all()
+
+    answer_rows = [
+        {**answer, 'result_id': result_id}
+        for row, result_id in zip(rows, result_ids)
+        for answer in row.get('answer_rows') or ()
+    ]
+    if answer_rows:
+        db.session.execute(db.insert(ResultAnswer), answer_rows)
+        # Суммы для анализа вопросов меняются в той же транзакции
+        item_analysis.record(
+            {**answer, 'score': row['percentage'] / 100}
+            for row in rows
+            for answer in row.get('answer_rows') or ()
+        )
+    return result_ids
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Получить очередь процесса или None, если отложенная запись выключена"""
+    global _writer
+    if not current_app.config.get('RESULTS_WRITE_BEHIND', False):
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = ResultWriter(
+                current_app._get_current_object(),
+                current_app.config.get('RESULTS_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                current_app.config.get('RESULTS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                current_app.config.get('RESULTS_MAX_PENDING', DEFAULT_MAX_PENDING),
+                current_app.config.get(
+                    'RESULTS_SPOOL_FILE', os.path.join(current_app.instance_path, SPOOL_FILE_NAME)
+                )
+            )
+    return _writer
+
+
+def enqueue(row):
+    """Отложить запись результата (словарь столбцов TestResult и answer_rows - ответы по вопросам).
+    False - режим выключен или очередь переполнена, и результат нужно сохранить сразу"""
+    writer = get_writer()
+    return writer is not None and writer.enqueue(row)
+
+
+def pending(test_id):
+    """Результаты теста из очереди отложенной записи"""
+    writer = get_writer()
+    return writer.pending(test_id) if writer else []
+
+
+def stats():
+    """Метрики отложенной записи"""
+    writer = get_writer()
+    return writer.stats() if writer else {'enabled': False}
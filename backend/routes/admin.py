@@ -1,10 +1,49 @@
 from flask import Blueprint, jsonify, request
-from models import db, Test, Question
+from models import db, Test, Question, ResultAnswer, TestResult
 from datetime import datetime
+import csv
+import json
 from .auth import require_admin
+from grading import validate_test_cases
+import answer_keys
+import drafts
+import item_analysis
+import leaderboard
+import question_import
+import result_writer
+import test_payloads
 
 bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
+@bp.route('/tests/<int:test_id>', methods=['GET'])
+@require_admin
+def get_test_for_admin(test_id):
+    """Получить тест целиком: с правильными ответами, пояснениями и тестовыми случаями"""
+    try:
+        test = db.session.get(Test, test_id)
+        if test is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        test_data = test.to_dict()
+        questions = Question.query.filter_by(test_id=test_id).order_by(Question.order.asc()).all()
+        test_data['questions'] = [question.to_dict(include_test_cases=True) for question in questions]
+        
+        response = jsonify({
+            'success': True,
+            'data': test_data
+        })
+        # Правильные ответы не должны попасть ни в какой кэш
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @bp.route('/questions/<int:test_id>', methods=['POST'])
 @require_admin
 def add_question_to_test(test_id):
@@ -13,7 +52,9 @@ def add_question_to_test(test_id):
         test = Test.query.get_or_404(test_id)
         data = request.get_json()
         
-        if not data or not data.get('question_text') or not data.get('correct_answer'):
+        is_code = bool(data) and data.get('question_type') == 'code'
+        
+        if not data or not data.get('question_text') or not (is_code or data.get('correct_answer')):
             return jsonify({
                 'success': False,
                 'error': 'Текст вопроса и правильный ответ обязательны'
@@ -26,20 +67,92 @@ def add_question_to_test(test_id):
             option_b=data.get('option_b', ''),
             option_c=data.get('option_c', ''),
             option_d=data.get('option_d', ''),
-            correct_answer=data['correct_answer'],
+            correct_answer='' if is_code else data['correct_answer'],
             explanation=data.get('explanation', ''),
-            order=data.get('order', 0)
+            order=data.get('order', 0),
+            question_type='code' if is_code else 'choice',
+            stop_on_failure=bool(data.get('stop_on_failure', False)),
+            tag=data.get('tag') or None
         )
+        if is_code:
+            # Для задачи с кодом вместо правильного ответа - тестовые случаи
+            question.test_cases = json.dumps(validate_test_cases(data.get('test_cases')))
         
         db.session.add(question)
+        Test.bump_version(test_id)
         db.session.commit()
+        answer_keys.invalidate(test_id)
         
         return jsonify({
             'success': True,
-            'data': question.to_dict(),
+            'data': question.to_dict(include_test_cases=True),
             'message': 'Вопрос успешно добавлен'
         }), 201
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@bp.route('/tests/<int:test_id>/questions/import', methods=['POST'])
+@require_admin
+def import_questions(test_id):
+    """Импортировать вопросы в тест из CSV или NDJSON в теле запроса.
+    Параметры: format=csv|ndjson (по умолчанию по Content-Type),
+    strict=true - при любой ошибочной строке ничего не добавлять.
+    Строки с ошибками пропускаются и перечисляются в отчёте с номерами строк"""
+    try:
+        import_format = question_import.detect_format(request.args.get('format'), request.mimetype)
+        strict = request.args.get('strict', 'false').lower() in ('true', '1', 'yes')
+        
+        if db.session.get(Test, test_id) is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        report = question_import.import_questions(
+            test_id, question_import.read_rows(request.stream, import_format)
+        )
+        if report['failed'] and strict:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': 'В файле есть ошибки, вопросы не добавлены',
+                'data': {**report, 'imported': 0}
+            }), 400
+        
+        if report['imported']:
+            Test.bump_version(test_id)
+        db.session.commit()
+        answer_keys.invalidate(test_id)
+        
+        return jsonify({
+            'success': True,
+            'data': report,
+            'message': f'Добавлено вопросов: {report["imported"]}, строк с ошибками: {report["failed"]}'
+        })
+        
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': 'Файл должен быть в кодировке UTF-8'
+        }), 400
+    except (ValueError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -61,6 +174,8 @@ def update_question(question_id):
                 'error': 'Данные для обновления не предоставлены'
             }), 400
         
+        graded_by = None if question.is_code else question.correct_answer
+        
         # Обновляем поля
         if 'question_text' in data:
             question.question_text = data['question_text']
@@ -78,15 +193,37 @@ def update_question(question_id):
             question.explanation = data['explanation']
         if 'order' in data:
             question.order = data['order']
+        if 'question_type' in data:
+            question.question_type = 'code' if data['question_type'] == 'code' else 'choice'
+        if 'test_cases' in data:
+            question.test_cases = json.dumps(validate_test_cases(data['test_cases']))
+        if 'stop_on_failure' in data:
+            question.stop_on_failure = bool(data['stop_on_failure'])
+        if 'tag' in data:
+            question.tag = data['tag'] or None
+        if question.is_code and not question.test_cases:
+            raise ValueError('Для задачи с кодом нужен хотя бы один тестовый случай')
         
+        # Правильный ответ изменился: анализ вопроса пересчитывается в той же транзакции
+        if (None if question.is_code else question.correct_answer) != graded_by:
+            item_analysis.regrade_question(question.id, None if question.is_code else question.correct_answer)
+        
+        Test.bump_version(question.test_id)
         db.session.commit()
+        answer_keys.invalidate(question.test_id)
         
         return jsonify({
             'success': True,
-            'data': question.to_dict(),
+            'data': question.to_dict(include_test_cases=True),
             'message': 'Вопрос успешно обновлен'
         })
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -101,8 +238,12 @@ def delete_question(question_id):
     try:
         question = Question.query.get_or_404(question_id)
         
+        test_id = question.test_id
+        
         db.session.delete(question)
+        Test.bump_version(test_id)
         db.session.commit()
+        answer_keys.invalidate(test_id)
         
         return jsonify({
             'success': True,
@@ -116,6 +257,104 @@ def delete_question(question_id):
             'error': str(e)
         }), 500
 
+@bp.route('/questions/<int:question_id>/answers', methods=['GET'])
+@require_admin
+def get_question_answers(question_id):
+    """Распределение ответов на вопрос: сколько студентов выбрали каждый вариант
+    и сколько ответили верно (один агрегатный запрос по индексу result_answers)"""
+    try:
+        rows = db.session.execute(
+            db.select(
+                ResultAnswer.chosen,
+                db.func.count(),
+                db.func.count().filter(ResultAnswer.is_correct.is_(True))
+            )
+            .where(ResultAnswer.question_id == question_id)
+            .group_by(ResultAnswer.chosen)
+        ).all()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'question_id': question_id,
+                'total': sum(count for _, count, _ in rows),
+                'correct': sum(correct for _, _, correct in rows),
+                # chosen = null - вопрос без ответа или задача с кодом
+                'choices': [
+                    {'chosen': chosen, 'count': count, 'correct': correct}
+                    for chosen, count, correct in sorted(rows, key=lambda row: row[0] or '')
+                ]
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@bp.route('/tests/<int:test_id>/item-analysis', methods=['GET'])
+@require_admin
+def get_item_analysis(test_id):
+    """Анализ вопросов теста: трудность (p_value - доля верных ответов),
+    различающая способность (корреляция правильности ответа с баллом за тест)
+    и распределение ответов по вариантам. Время не зависит от числа результатов"""
+    try:
+        if db.session.get(Test, test_id) is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        questions = db.session.execute(
+            db.select(Question.id, Question.question_text, Question.question_type)
+            .where(Question.test_id == test_id)
+            .order_by(Question.order, Question.id)
+        ).all()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'test_id': test_id,
+                'questions': item_analysis.analyze(questions)
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@bp.route('/results/<int:result_id>', methods=['DELETE'])
+@require_admin
+def delete_result(result_id):
+    """Удалить результат теста вместе с ответами; анализ вопросов и таблица лидеров пересчитываются"""
+    try:
+        result = db.session.get(TestResult, result_id)
+        if result is None:
+            return jsonify({
+                'success': False,
+                'error': 'Результат не найден'
+            }), 404
+        
+        test_id = result.test_id
+        item_analysis.retract_result(result_id)
+        db.session.execute(db.delete(ResultAnswer).where(ResultAnswer.result_id == result_id))
+        db.session.delete(result)
+        db.session.commit()
+        leaderboard.invalidate(test_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Результат успешно удален'
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @bp.route('/stats', methods=['GET'])
 @require_admin
 def get_stats():
@@ -162,3 +401,16 @@ def get_stats():
             'success': False,
             'error': str(e)
         }), 500
+
+@bp.route('/metrics', methods=['GET'])
+@require_admin
+def get_metrics():
+    """Получить метрики сервера: очередь отложенной записи результатов, черновики и готовые ответы тестов"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'results_writer': result_writer.stats(),
+            'drafts': drafts.get_store().stats(),
+            'test_payloads': test_payloads.stats()
+        }
+    })
@@ -1,13 +1,110 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, session
+import json
 import subprocess
-import tempfile
-import os
 import sys
-import traceback
-from io import StringIO
+import time
+from concurrent.futures import ThreadPoolExecutor
+import sandbox
+import jobs
+import result_cache
+import sessions
+from routes.auth import require_admin, require_auth
 
 bp = Blueprint('compiler', __name__, url_prefix='/api/compiler')
 
+# Ограничение времени выполнения кода в секундах
+EXECUTION_TIMEOUT = 10
+# Максимальное число фрагментов кода в одном пакетном запросе
+MAX_BATCH_SIZE = 500
+
+def limit_message(limit, limits):
+    """Сообщение о превышенном лимите ресурсов"""
+    if limit == 'timeout':
+        return f'Превышено время выполнения ({EXECUTION_TIMEOUT} секунд)'
+    if limit == 'cpu':
+        return f'Превышен лимит процессорного времени ({limits["cpu"]} секунд)'
+    if limit == 'memory':
+        return f'Превышен лимит памяти ({limits["memory"] // (1024 * 1024)} МБ)'
+    if limit == 'file_size':
+        return f'Превышен максимальный размер файла ({limits["file_size"]} байт)'
+    if limit == 'processes':
+        return 'Превышен лимит числа процессов'
+    if limit == 'output':
+        return f'Превышен объём вывода ({limits["output"]} байт), выполнение остановлено'
+    return 'Ошибка выполнения кода'
+
+def limit_response(limit, limits, result=None):
+    """Ответ для запуска, остановленного по лимиту ресурсов"""
+    response = {
+        'success': False,
+        'error': limit_message(limit, limits),
+        'limit': limit
+    }
+    if result is not None:
+        # Вывод до остановки тоже полезен студенту
+        if result['stdout']:
+            response['output'] = result['stdout']
+        if result['stderr']:
+            response['error'] += '\n\n' + result['stderr']
+    return response
+
+def syntax_error_response(error):
+    """Ответ для кода, который не компилируется"""
+    return {
+        'success': False,
+        'error': error['formatted'],
+        'syntax_error': {name: value for name, value in error.items() if name != 'formatted'}
+    }
+
+def run_code(pool, cache, code, with_telemetry=False):
+    """Выполнить код в пуле и сформировать ответ в формате /execute.
+    with_telemetry добавляет в ответ время, процессорное время и память запуска"""
+    # Синтаксические ошибки находим сразу, не занимая рабочий процесс
+    tree, error = sandbox.check_syntax(code)
+    if error:
+        return syntax_error_response(error)
+    
+    key = result_cache.cache_key(code, tree)
+    result = cache.get(key) if key else None
+    measurement = {'cached': True}
+    
+    try:
+        if result is None:
+            # Выполняем код на одном из прогретых интерпретаторов
+            result = pool.execute(code, timeout=EXECUTION_TIMEOUT)
+            measurement = result.pop('telemetry')
+            if key:
+                cache.put(key, result)
+    except sandbox.ExecutionTimeout as e:
+        response = limit_response('timeout', pool.limits)
+        if with_telemetry:
+            response['telemetry'] = e.telemetry
+        return response
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'Ошибка выполнения: {str(e)}'
+        }
+    
+    response = result_response(result, pool.limits)
+    if with_telemetry:
+        response['telemetry'] = measurement
+    return response
+
+def result_response(result, limits):
+    """Ответ в формате /execute по результату рабочего процесса"""
+    if result['limit']:
+        return limit_response(result['limit'], limits, result)
+    if result['returncode'] == 0:
+        return {
+            'success': True,
+            'output': result['stdout']
+        }
+    return {
+        'success': False,
+        'error': result['stderr'] or 'Ошибка выполнения кода'
+    }
+
 @bp.route('/execute', methods=['POST'])
 def execute_code():
     """Выполнить Python код"""
@@ -20,64 +117,334 @@ def execute_code():
                 'error': 'Код не предоставлен'
             }), 400
         
-        code = data['code']
+        return jsonify(run_code(
+            sandbox.get_pool(), result_cache.get_cache(), data['code'], bool(data.get('telemetry'))
+        ))
+            
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Ошибка сервера: {str(e)}'
+        }), 500
+
+@bp.route('/execute/batch', methods=['POST'])
+@require_admin
+def execute_batch():
+    """Выполнить пакет фрагментов кода параллельно (например, все примеры из лекций)"""
+    try:
+        data = request.get_json()
+        snippets = data.get('snippets') if data else None
         
-        # Проверяем, есть ли уже объявление кодировки в коде
-        if not ('coding:' in code or 'encoding:' in code):
-            code = '# -*- coding: utf-8 -*-\n' + code
+        if not isinstance(snippets, list) or not snippets:
+            return jsonify({
+                'success': False,
+                'error': 'Список фрагментов кода не предоставлен'
+            }), 400
         
-        # Создаем временный файл для кода с указанием кодировки UTF-8
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as f:
-            f.write(code)
-            temp_file = f.name
+        if len(snippets) > MAX_BATCH_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'Слишком много фрагментов (максимум {MAX_BATCH_SIZE})'
+            }), 400
         
-        try:
-            # Выполняем код и захватываем вывод
-            result = subprocess.run(
-                [sys.executable, temp_file],
-                capture_output=True,
-                text=True,
-                timeout=10,  # Ограничение времени выполнения
-                cwd=tempfile.gettempdir()
-            )
-            
-            # Удаляем временный файл
-            os.unlink(temp_file)
-            
-            if result.returncode == 0:
-                return jsonify({
-                    'success': True,
-                    'output': result.stdout
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': result.stderr or 'Ошибка выполнения кода'
-                })
-                
-        except subprocess.TimeoutExpired:
-            # Удаляем временный файл
-            os.unlink(temp_file)
+        # Фрагмент может быть строкой или объектом с кодом и идентификатором
+        snippets = [snippet if isinstance(snippet, dict) else {'code': snippet} for snippet in snippets]
+        if not all(isinstance(snippet.get('code'), str) and snippet['code'] for snippet in snippets):
             return jsonify({
                 'success': False,
-                'error': 'Превышено время выполнения (10 секунд)'
+                'error': 'Каждый фрагмент должен содержать код'
+            }), 400
+        
+        pool = sandbox.get_batch_pool()
+        cache = result_cache.get_cache()
+        with_telemetry = bool(data.get('telemetry'))
+        
+        def run_snippet(snippet):
+            started = time.perf_counter()
+            result = run_code(pool, cache, snippet['code'], with_telemetry)
+            result['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            if 'id' in snippet:
+                result['id'] = snippet['id']
+            return result
+        
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(pool.size, len(snippets))) as executor:
+            # map сохраняет порядок фрагментов
+            results = list(executor.map(run_snippet, snippets))
+        total_ms = round((time.perf_counter() - started) * 1000, 2)
+        
+        succeeded = sum(1 for result in results if result['success'])
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'results': results,
+                'total': len(results),
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded,
+                'total_ms': total_ms,
+                'sequential_ms': round(sum(result['duration_ms'] for result in results), 2),
+                'workers': pool.size
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Ошибка сервера: {str(e)}'
+        }), 500
+
+def sse_event(event, data):
+    """Сформировать одно событие Server-Sent Events"""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+@bp.route('/execute/stream', methods=['POST'])
+def execute_code_stream():
+    """Выполнить Python код, отдавая вывод по мере появления (Server-Sent Events)"""
+    data = request.get_json(silent=True)
+    
+    if not data or not data.get('code'):
+        return jsonify({
+            'success': False,
+            'error': 'Код не предоставлен'
+        }), 400
+    
+    pool = sandbox.get_pool()
+    tree, error = sandbox.check_syntax(data['code'])
+    with_telemetry = bool(data.get('telemetry'))
+    
+    def done(response, measurement=None):
+        if with_telemetry:
+            response['telemetry'] = measurement
+        return sse_event('done', response)
+    
+    def generate():
+        if error:
+            yield sse_event('output', {
+                'stream': 'stderr',
+                'text': error['formatted']
             })
-            
+            yield done(syntax_error_response(error))
+            return
+        
+        try:
+            for message in pool.stream(data['code'], EXECUTION_TIMEOUT):
+                if message['type'] == 'output':
+                    yield sse_event('output', {
+                        'stream': message['stream'],
+                        'text': message['data']
+                    })
+                elif message['limit']:
+                    yield done(limit_response(message['limit'], pool.limits), message['telemetry'])
+                else:
+                    yield done({
+                        'success': message['returncode'] == 0,
+                        'returncode': message['returncode']
+                    }, message['telemetry'])
+        except sandbox.ExecutionTimeout as e:
+            yield done(limit_response('timeout', pool.limits), e.telemetry)
         except Exception as e:
-            # Удаляем временный файл
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-            return jsonify({
+            yield sse_event('done', {
                 'success': False,
                 'error': f'Ошибка выполнения: {str(e)}'
             })
-            
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # отключаем буферизацию в прокси
+    })
+
+@bp.route('/jobs', methods=['POST'])
+def create_job():
+    """Поставить код в очередь на выполнение и сразу вернуть идентификатор задания"""
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('code'):
+            return jsonify({
+                'success': False,
+                'error': 'Код не предоставлен'
+            }), 400
+        
+        # Пул и кэш получаем здесь: потоки очереди работают вне контекста приложения
+        job_id = jobs.get_queue().submit(
+            run_code, sandbox.get_pool(), result_cache.get_cache(), data['code'], bool(data.get('telemetry'))
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'id': job_id,
+                'status': 'queued'
+            }
+        }), 202
+        
+    except jobs.QueueFull:
+        return jsonify({
+            'success': False,
+            'error': 'Очередь выполнения переполнена, попробуйте позже'
+        }), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Ошибка сервера: {str(e)}'
+        }), 500
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Получить состояние и результат задания"""
+    job = jobs.get_queue().get(job_id)
+    
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': 'Задание не найдено'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'data': job
+    })
+
+# Почему интерактивная сессия была закрыта после ячейки
+SESSION_CLOSED_MESSAGES = {
+    'memory': 'Сессия закрыта: интерпретатор занял слишком много памяти',
+    'evicted': 'Сессия закрыта во время выполнения ячейки',
+    'crashed': 'Сессия закрыта: интерпретатор завершился'
+}
+
+def session_owner():
+    """Владелец интерактивной сессии - вошедший пользователь (маршруты сессий требуют входа).
+    Анонимный браузер без cookie получал бы нового владельца на каждый запрос"""
+    return f'user:{session["user_id"]}'
+
+def session_not_found():
+    return jsonify({
+        'success': False,
+        'error': 'Сессия не найдена или закрыта'
+    }), 404
+
+@bp.route('/sessions', methods=['POST'])
+@require_auth
+def create_session():
+    """Открыть интерактивную сессию: интерпретатор, сохраняющий состояние между ячейками.
+    Прежняя сессия пользователя при этом закрывается"""
+    try:
+        repl = sessions.get_manager().create(session_owner())
+        return jsonify({
+            'success': True,
+            'data': repl.to_dict()
+        }), 201
+    except sessions.SessionRateLimited:
+        return jsonify({
+            'success': False,
+            'error': 'Сессии открываются слишком часто, повторите попытку позже'
+        }), 429
+    except sessions.SessionLimitReached:
+        return jsonify({
+            'success': False,
+            'error': 'Все интерактивные сессии заняты, повторите попытку позже'
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Ошибка сервера: {str(e)}'
         }), 500
 
+@bp.route('/sessions/<session_id>', methods=['GET'])
+@require_auth
+def get_session(session_id):
+    """Получить состояние интерактивной сессии"""
+    repl = sessions.get_manager().get(session_id, session_owner())
+    if repl is None:
+        return session_not_found()
+    return jsonify({
+        'success': True,
+        'data': repl.to_dict()
+    })
+
+@bp.route('/sessions/<session_id>/cells', methods=['POST'])
+@require_auth
+def run_session_cell(session_id):
+    """Выполнить ячейку в интерактивной сессии; значение последнего выражения выводится"""
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('code'):
+            return jsonify({
+                'success': False,
+                'error': 'Код не предоставлен'
+            }), 400
+        
+        manager = sessions.get_manager()
+        repl = manager.get(session_id, session_owner())
+        if repl is None:
+            return session_not_found()
+        
+        _, error = sandbox.check_syntax(data['code'])
+        if error:
+            return jsonify({**syntax_error_response(error), 'session': repl.to_dict()})
+        
+        try:
+            result = manager.run_cell(repl, data['code'], EXECUTION_TIMEOUT)
+        except sandbox.ExecutionTimeout as e:
+            # Состояние прерванного интерпретатора потеряно
+            response = {**limit_response('timeout', manager.limits), 'session_closed': 'timeout'}
+            if data.get('telemetry'):
+                response['telemetry'] = e.telemetry
+            return jsonify(response)
+        
+        response = result_response(result, manager.limits)
+        if data.get('telemetry'):
+            response['telemetry'] = result['telemetry']
+        if 'session_closed' in result:
+            response['session_closed'] = result['session_closed']
+            message = SESSION_CLOSED_MESSAGES.get(result['session_closed'])
+            if message:
+                response['error'] = f'{response["error"]}\n\n{message}' if response.get('error') else message
+        response['session'] = repl.to_dict()
+        return jsonify(response)
+        
+    except sessions.SessionBusy:
+        return jsonify({
+            'success': False,
+            'error': 'В сессии уже выполняется код'
+        }), 409
+    except sessions.SessionClosed:
+        return session_not_found()
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Ошибка сервера: {str(e)}'
+        }), 500
+
+@bp.route('/sessions/<session_id>', methods=['DELETE'])
+@require_auth
+def close_session(session_id):
+    """Закрыть интерактивную сессию"""
+    manager = sessions.get_manager()
+    repl = manager.get(session_id, session_owner())
+    if repl is None:
+        return session_not_found()
+    manager.close(repl)
+    return jsonify({
+        'success': True,
+        'message': 'Сессия закрыта'
+    })
+
+@bp.route('/metrics', methods=['GET'])
+@require_admin
+def get_metrics():
+    """Получить метрики компилятора: кэш и гистограммы запусков по пулам"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'cache': result_cache.get_cache().stats(),
+            'executions': sandbox.execution_stats(),
+            'sessions': sessions.get_manager().snapshot()
+        }
+    })
+
 @bp.route('/check', methods=['GET'])
 def check_compiler():
     """Проверить доступность компилятора"""
@@ -1,52 +1,236 @@
-from flask import Blueprint, jsonify, request
-from models import db, Test, Question, TestResult
-from datetime import datetime
+from flask import Blueprint, Response, jsonify, request, session, stream_with_context
+from models import ANONYMOUS_STUDENT, ANSWER_OPTIONS, db, Test, Question, TestResult
+from sqlalchemy.exc import IntegrityError
+from datetime import date, datetime, timedelta
+import base64
+import binascii
+import csv
+import io
 import json
+import uuid
 from routes.auth import require_admin
+from grading import grade_code, validate_test_cases
+from answer_keys import attempt_questions, draw_question_ids, get_answer_key
+import drafts
+import idempotency
+import leaderboard
+import result_writer
+import sandbox
+import test_payloads
 
 bp = Blueprint('tests', __name__, url_prefix='/api/tests')
 
+# Размер страницы результатов теста: по умолчанию и наибольший допустимый
+DEFAULT_RESULTS_PAGE_SIZE = 50
+MAX_RESULTS_PAGE_SIZE = 200
+# Размер таблицы лидеров: по умолчанию и наибольший допустимый
+DEFAULT_LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+# Наибольший размер черновика ответов, байты
+MAX_DRAFT_SIZE = 64 * 1024
+# Выгрузка результатов: сколько строк читать из базы за раз и типы файлов
+EXPORT_BATCH_SIZE = 1000
+# Версия формата ответа get_test: входит в ETag, чтобы после изменения формата кэш не использовался
+STUDENT_PAYLOAD_FORMAT = 1
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8'
+}
+
+def wants_gzip():
+    """Принимает ли клиент ответ, сжатый gzip"""
+    return bool(request.accept_encodings['gzip'])
+
+def coded_etag(etag, gzipped):
+    """Сжатое и несжатое тело - разные представления, и ETag у них разный (RFC 9110)"""
+    return f'{etag}-gz' if gzipped else etag
+
+def not_modified(etag):
+    """Ответ 304 для готового JSON: с теми же ETag, Vary и Cache-Control, что и полный ответ"""
+    response = Response(status=304)
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
+def blob_response(blob, etag, gzipped):
+    """Ответ из готового JSON: сжатый, если клиент принимает gzip.
+    etag - ETag выбранного представления (см. coded_etag)"""
+    if gzipped:
+        response = Response(blob.gzipped, content_type='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(blob.body, content_type='application/json')
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    # Кэшировать можно и в CDN, но каждый раз с проверкой версии
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
+def build_tests_payload():
+    """Список активных тестов для студентов"""
+    tests = Test.query.filter_by(is_active=True).all()
+    return {
+        'success': True,
+        'data': [test.to_dict() for test in tests]
+    }
+
+def build_test_payload(test_id):
+    """Тест со всеми вопросами для студентов"""
+    test = db.session.get(Test, test_id)
+    test_data = test.to_dict()
+    
+    # Добавляем вопросы к тесту
+    questions = Question.query.filter_by(test_id=test_id).order_by(Question.order.asc()).all()
+    test_data['questions'] = [question.to_student_dict() for question in questions]
+    return {
+        'success': True,
+        'data': test_data
+    }
+
 @bp.route('/', methods=['GET'])
 def get_tests():
-    """Получить список всех тестов"""
+    """Получить список всех тестов.
+    Ответ собирается заново, только когда меняется набор активных тестов или версия одного из них"""
     try:
-        tests = Test.query.filter_by(is_active=True).all()
-        return jsonify({
-            'success': True,
-            'data': [test.to_dict() for test in tests]
-        })
+        # Состояние списка одним агрегатным запросом: новый тест меняет число и наибольший id,
+        # изменение вопросов - сумму версий
+        state = tuple(db.session.execute(
+            db.select(
+                db.func.count(Test.id),
+                db.func.coalesce(db.func.sum(Test.version), 0),
+                db.func.coalesce(db.func.max(Test.id), 0)
+            ).where(Test.is_active.is_(True))
+        ).one())
+        gzipped = wants_gzip()
+        etag = coded_etag('tests-{}-{}-{}-f{}'.format(*state, STUDENT_PAYLOAD_FORMAT), gzipped)
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        
+        blob = test_payloads.get_blob('tests', state, build_tests_payload)
+        return blob_response(blob, etag, gzipped)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def test_etag(test_id, version, seed=None):
+    """Сильный ETag теста для студентов: меняется вместе с содержимым теста и форматом ответа"""
+    etag = f'test-{test_id}-v{version or 1}-f{STUDENT_PAYLOAD_FORMAT}'
+    return etag if seed is None else f'{etag}-s{seed}'
+
 @bp.route('/<int:test_id>', methods=['GET'])
 def get_test(test_id):
-    """Получить конкретный тест по ID"""
+    """Получить тест для прохождения: вопросы без правильных ответов и пояснений.
+    Ответ помечается ETag версии теста; при совпадении If-None-Match возвращается 304
+    (полный вариант для администратора - GET /api/admin/tests/<id>).
+    В тесте со случайным вариантом выдаётся pool_size вопросов из банка: номер
+    варианта seed выбирает сервер и хранит до отправки ответов, так что повторное
+    открытие теста возвращает тот же вариант, а выбрать вариант клиент не может"""
     try:
-        test = Test.query.get_or_404(test_id)
-        test_data = test.to_dict()
+        test_info = db.session.execute(
+            db.select(Test.version, Test.pool_size).where(Test.id == test_id)
+        ).first()
+        if test_info is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
         
-        # Добавляем вопросы к тесту
-        questions = Question.query.filter_by(test_id=test_id).order_by(Question.order.asc()).all()
-        test_data['questions'] = [question.to_dict() for question in questions]
+        seed = None
+        if test_info.pool_size:
+            seed = drafts.issue_seed(test_id, student_owner())
         
+        # Тест без случайного варианта отдаётся из готового JSON, сжатым или нет
+        gzipped = seed is None and wants_gzip()
+        etag = coded_etag(test_etag(test_id, test_info.version, seed), gzipped)
+        if etag in request.if_none_match:
+            # Клиент или CDN уже получили эту версию: вопросы не читаем
+            if seed is None:
+                return not_modified(etag)
+            response = Response(status=304)
+        elif seed is None:
+            # Готовый сжатый ответ из памяти, пока версия теста не изменилась
+            blob = test_payloads.get_blob(
+                ('test', test_id), test_info.version, lambda: build_test_payload(test_id)
+            )
+            return blob_response(blob, etag, gzipped)
+        else:
+            test = db.session.get(Test, test_id)
+            test_data = test.to_dict()
+            
+            # Номера вопросов варианта берём из кэша ключа ответов,
+            # а из базы читаем только их, по первичному ключу
+            question_ids = draw_question_ids(get_answer_key(test_id), seed)
+            by_id = {
+                question.id: question
+                for question in Question.query.filter(Question.id.in_(question_ids))
+            }
+            questions = [by_id[question_id] for question_id in question_ids if question_id in by_id]
+            test_data['seed'] = seed
+            test_data['questions_count'] = len(questions)
+            test_data['questions'] = [question.to_student_dict() for question in questions]
+            
+            response = jsonify({
+                'success': True,
+                'data': test_data
+            })
+        
+        response.set_etag(etag)
+        # Вариант принадлежит попытке студента: в общих кэшах его хранить нельзя
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': test_data
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def load_submission(test_id, idempotency_key):
+    """Сохранённый ответ на отправку с этим ключом или None"""
+    response_data = db.session.execute(
+        db.select(TestResult.response_data).where(
+            TestResult.test_id == test_id,
+            TestResult.idempotency_key == idempotency_key
+        )
+    ).scalar()
+    return json.loads(response_data) if response_data else None
+
+def attempt_submitted(test_id, idempotency_key):
+    """Отправлена ли уже попытка с этим ключом: черновик с таким ключом устарел"""
+    if not isinstance(idempotency_key, str):
+        return False
+    if idempotency.submitted((test_id, idempotency_key)):
+        return True
+    # Результат может ещё ждать в очереди отложенной записи
+    if any(row.get('idempotency_key') == idempotency_key for row in result_writer.pending(test_id)):
+        return True
+    return db.session.execute(
+        db.select(TestResult.id).where(
+            TestResult.test_id == test_id,
+            TestResult.idempotency_key == idempotency_key
+        )
+    ).first() is not None
+
+def replay_submission(body):
+    """Повторить первый ответ на отправку"""
+    response = jsonify(body)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @bp.route('/<int:test_id>/submit', methods=['POST'])
 def submit_test(test_id):
-    """Отправить ответы на тест"""
+    """Отправить ответы на тест.
+    Ключ попытки (заголовок Idempotency-Key или поле idempotency_key) защищает от
+    повторной проверки: на повтор с тем же ключом возвращается первый ответ"""
+    scope = claim_token = None
     try:
-        test = Test.query.get_or_404(test_id)
         data = request.get_json()
         
         if not data:
@@ -55,12 +239,46 @@ def submit_test(test_id):
                 'error': 'Данные ответов не предоставлены'
             }), 400
         
-        student_name = data.get('student_name', 'Анонимный студент')
+        student_name = data.get('student_name', ANONYMOUS_STUDENT)
+        owner = student_owner()
         answers = data.get('answers', {})
         time_taken = data.get('time_taken', 0)
         
-        # Получаем все вопросы теста
-        questions = Question.query.filter_by(test_id=test_id).all()
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        if idempotency_key is not None:
+            if not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= idempotency.MAX_KEY_LENGTH:
+                return jsonify({
+                    'success': False,
+                    'error': f'Ключ попытки должен быть строкой не длиннее {idempotency.MAX_KEY_LENGTH} символов'
+                }), 400
+            scope = (test_id, idempotency_key)
+            stored, claim_token = idempotency.claim(scope)
+            if stored is None:
+                stored = load_submission(test_id, idempotency_key)
+                if stored is not None:
+                    idempotency.complete(scope, stored, claim_token)
+            if stored is not None:
+                return replay_submission(stored)
+        
+        # Правильные ответы берём из кэша, а не загружаем вопросы целиком
+        answer_key = get_answer_key(test_id)
+        if answer_key is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        # В тесте со случайным вариантом проверяем вопросы варианта, выданного этому студенту;
+        # вариант забирается в транзакции сохранения результата
+        seed = None
+        if answer_key['pool_size']:
+            seed = drafts.consume_seed(test_id, owner)
+            if seed is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Вариант теста не выдан или уже отправлен: откройте тест заново'
+                }), 400
+        questions = attempt_questions(answer_key, seed)
         
         if not questions:
             return jsonify({
@@ -72,45 +290,53 @@ def submit_test(test_id):
         correct_answers = 0
         total_questions = len(questions)
         detailed_results = []
+        answer_rows = []
         
+        pool = None
         for question in questions:
-            question_id = str(question.id)
+            question_id = str(question['id'])
             user_answer = answers.get(question_id)
-            is_correct = user_answer == question.correct_answer
+            
+            if question['is_code']:
+                # Задачи с кодом проверяем на тестовых случаях в песочнице
+                # Отдельный пул: его процессы не выполняли чужой код с /execute
+                pool = pool or sandbox.get_grading_pool()
+                grading = grade_code(pool, user_answer, question['test_cases'], question['stop_on_failure'])
+                is_correct = grading['is_correct']
+            else:
+                is_correct = user_answer == question['correct_answer']
             
             if is_correct:
                 correct_answers += 1
             
-            detailed_results.append({
-                'question_id': question.id,
-                'question_text': question.question_text,
+            answer_rows.append({
+                'question_id': question['id'],
+                'chosen': user_answer if not question['is_code'] and user_answer in ANSWER_OPTIONS else None,
+                'is_correct': is_correct
+            })
+            
+            question_result = {
+                'question_id': question['id'],
+                'question_text': question['question_text'],
                 'user_answer': user_answer,
-                'correct_answer': question.correct_answer,
+                'correct_answer': question['correct_answer'],
                 'is_correct': is_correct,
-                'explanation': question.explanation
-            })
+                'explanation': question['explanation']
+            }
+            if question['is_code']:
+                question_result['test_cases'] = grading['cases']
+                question_result['error'] = grading['error']
+            detailed_results.append(question_result)
         
         # Вычисляем процент
         percentage = (correct_answers / total_questions) * 100
         
-        # Сохраняем результат в базу данных
-        test_result = TestResult(
-            test_id=test_id,
-            student_name=student_name,
-            score=correct_answers,
-            total_questions=total_questions,
-            percentage=percentage,
-            time_taken=time_taken,
-            answers=json.dumps(answers)
-        )
-        
-        db.session.add(test_result)
-        db.session.commit()
+        completed_at = datetime.utcnow()
         
         # Определяем статус прохождения
-        passed = percentage >= test.passing_score
+        passed = percentage >= answer_key['passing_score']
         
-        return jsonify({
+        body = {
             'success': True,
             'data': {
                 'test_id': test_id,
@@ -119,41 +345,369 @@ def submit_test(test_id):
                 'total_questions': total_questions,
                 'percentage': round(percentage, 2),
                 'time_taken': time_taken,
+                'seed': seed,
                 'passed': passed,
-                'passing_score': test.passing_score,
+                'passing_score': answer_key['passing_score'],
                 'detailed_results': detailed_results,
-                'completed_at': test_result.completed_at.isoformat()
+                'completed_at': completed_at.isoformat()
             },
             'message': f'Тест {"пройден" if passed else "не пройден"}! Результат: {round(percentage, 2)}%'
-        })
+        }
+        
+        # Сохраняем результат в базу данных
+        result_row = {
+            'test_id': test_id,
+            'student_name': student_name,
+            'owner': owner,
+            'score': correct_answers,
+            'total_questions': total_questions,
+            'percentage': percentage,
+            'time_taken': time_taken,
+            'answers': json.dumps(answers),
+            'seed': seed,
+            'idempotency_key': idempotency_key,
+            # Ответ храним только для отправок с ключом: по нему отвечаем на повтор
+            'response_data': json.dumps(body) if scope else None,
+            'completed_at': completed_at,
+            # Ответы по вопросам сохраняются в той же транзакции, что и результат
+            'answer_rows': answer_rows
+        }
+        if not answer_key['pool_size']:
+            # Черновик удаляется в транзакции результата (у варианта его удалил consume_seed)
+            drafts.delete(test_id, owner)
+        if not result_writer.enqueue(result_row):
+            # Отложенная запись выключена или её очередь переполнена
+            try:
+                result_writer.insert_results([result_row])
+                db.session.commit()
+            except IntegrityError:
+                # Отправку с тем же ключом уже сохранил другой процесс сервера
+                db.session.rollback()
+                stored = load_submission(test_id, idempotency_key) if scope else None
+                if stored is None:
+                    raise
+                idempotency.complete(scope, stored, claim_token)
+                return replay_submission(stored)
+        else:
+            # Результат запишется в фоне, а вариант и черновик удаляем сразу
+            db.session.commit()
         
+        if scope:
+            idempotency.complete(scope, body, claim_token)
+        leaderboard.record(test_id, owner, student_name, percentage, time_taken, completed_at)
+        # Тест отправлен: несохранённый черновик процесса больше не нужен
+        drafts.get_store().discard((test_id, owner))
+        return jsonify(body)
+        
+    except idempotency.SubmissionInProgress:
+        return jsonify({
+            'success': False,
+            'error': 'Ответы с этим ключом ещё проверяются, повторите запрос позже'
+        }), 409
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
+    finally:
+        if claim_token is not None:
+            # Если ответ не сохранён, повтор с этим ключом проверит ответы заново.
+            # Снимаем только своё закрепление: ожидавший или повторённый запрос ключом не владеет
+            idempotency.release(scope, claim_token)
+
+@bp.route('/<int:test_id>/leaderboard', methods=['GET'])
+def get_leaderboard(test_id):
+    """Таблица лидеров теста: лучший результат каждого студента.
+    Параметр limit - сколько первых мест вернуть; в student - место того, кто запрашивает
+    (вошедшего пользователя или браузера), если у него есть результат"""
+    try:
+        limit = min(request.args.get('limit', DEFAULT_LEADERBOARD_SIZE, type=int), MAX_LEADERBOARD_SIZE)
+        if limit < 1:
+            return jsonify({
+                'success': False,
+                'error': 'Параметр limit должен быть положительным'
+            }), 400
+        
+        # Проверяем тест по кэшу ключей ответов
+        if get_answer_key(test_id) is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'test_id': test_id,
+                **leaderboard.query(test_id, limit, student_owner(create=False))
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def student_owner(create=True):
+    """Владелец попытки (черновика, результата): вошедший пользователь или браузер (по cookie сессии)"""
+    if 'user_id' in session:
+        return f'user:{session["user_id"]}'
+    if 'draft_owner' not in session and create:
+        session['draft_owner'] = uuid.uuid4().hex
+    return session.get('draft_owner')
+
+@bp.route('/<int:test_id>/draft', methods=['PUT'])
+def save_draft(test_id):
+    """Сохранить черновик ответов во время прохождения теста.
+    Черновик хранится в памяти и записывается в базу периодически, поэтому
+    браузер может сохранять ответы хоть после каждого изменения"""
+    try:
+        if request.content_length and request.content_length > MAX_DRAFT_SIZE:
+            return jsonify({
+                'success': False,
+                'error': 'Черновик слишком большой'
+            }), 413
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('answers', {}), dict):
+            return jsonify({
+                'success': False,
+                'error': 'Ответы черновика должны быть объектом'
+            }), 400
+        
+        # Проверяем тест по кэшу ключей ответов, а не запросом к базе
+        if get_answer_key(test_id) is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        # Запоздавшее сохранение отправленной попытки вернуло бы её ключ новой попытке
+        if attempt_submitted(test_id, data.get('idempotency_key')):
+            return jsonify({
+                'success': False,
+                'error': 'Эта попытка уже отправлена'
+            }), 409
+        
+        draft = {
+            'answers': data.get('answers', {}),
+            'idempotency_key': data.get('idempotency_key')
+        }
+        encoded = json.dumps(draft, ensure_ascii=False)
+        if len(encoded) > MAX_DRAFT_SIZE:
+            return jsonify({
+                'success': False,
+                'error': 'Черновик слишком большой'
+            }), 413
+        
+        saved_at = drafts.get_store().save((test_id, student_owner()), encoded)
+        return jsonify({
+            'success': True,
+            'data': {
+                'saved_at': saved_at.isoformat()
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@bp.route('/<int:test_id>/draft', methods=['GET'])
+def get_draft(test_id):
+    """Получить черновик ответов (например, после перезагрузки страницы) или null"""
+    try:
+        owner = student_owner(create=False)
+        draft = drafts.get_store().load((test_id, owner)) if owner else None
+        if draft is not None:
+            encoded, saved_at = draft
+            draft = json.loads(encoded)
+            # Черновик отправленной попытки (его мог дописать другой процесс уже после отправки)
+            if attempt_submitted(test_id, draft.get('idempotency_key')):
+                draft = None
+        if draft is None:
+            return jsonify({
+                'success': True,
+                'data': None
+            })
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                **draft,
+                'saved_at': saved_at.isoformat() if saved_at else None
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def encode_cursor(result):
+    """Курсор страницы: позиция последнего результата в порядке (completed_at, id)"""
+    position = json.dumps([result.completed_at.isoformat(), result.id])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Позиция из курсора или ValueError"""
+    try:
+        completed_at, result_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(completed_at), int(result_id)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError('Некорректный курсор страницы')
 
 @bp.route('/<int:test_id>/results', methods=['GET'])
 def get_test_results(test_id):
-    """Получить результаты теста"""
+    """Получить результаты теста постранично, от новых к старым.
+    Параметры: limit (не больше MAX_RESULTS_PAGE_SIZE), cursor из next_cursor
+    предыдущей страницы, include_answers=false - без ответов студентов"""
     try:
-        test = Test.query.get_or_404(test_id)
-        results = TestResult.query.filter_by(test_id=test_id).order_by(TestResult.completed_at.desc()).all()
+        test = db.session.get(Test, test_id)
+        if test is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+        
+        limit = request.args.get('limit', DEFAULT_RESULTS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_RESULTS_PAGE_SIZE))
+        include_answers = request.args.get('include_answers', 'true').lower() not in ('false', '0', 'no')
+        
+        # Keyset-пагинация: страница читается по индексу (test_id, completed_at)
+        # с того места, где закончилась предыдущая, без OFFSET
+        query = TestResult.query.filter_by(test_id=test_id)
+        cursor = request.args.get('cursor')
+        if cursor:
+            query = query.filter(db.tuple_(TestResult.completed_at, TestResult.id) < decode_cursor(cursor))
+        if not include_answers:
+            query = query.options(db.defer(TestResult.answers))
+        results = query.order_by(TestResult.completed_at.desc(), TestResult.id.desc()).limit(limit + 1).all()
+        
+        has_more = len(results) > limit
+        results = results[:limit]
         
         return jsonify({
             'success': True,
             'data': {
                 'test': test.to_dict(),
-                'results': [result.to_dict() for result in results]
+                'results': [result.to_dict(include_answers) for result in results],
+                'has_more': has_more,
+                'next_cursor': encode_cursor(results[-1]) if has_more else None
             }
         })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def parse_date_param(name, end_of_day=False):
+    """Дата или дата со временем из параметра запроса (ISO 8601) или None.
+    С end_of_day дата без времени означает конец этого дня"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        start = datetime(day.year, day.month, day.day)
+        return start + timedelta(days=1, microseconds=-1) if end_of_day else start
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Некорректная дата в параметре {name}, ожидается ГГГГ-ММ-ДД')
+
+@bp.route('/<int:test_id>/results/export', methods=['GET'])
+def export_test_results(test_id):
+    """Выгрузить результаты теста в CSV или NDJSON.
+    Строки читаются из базы порциями и сразу отдаются клиенту, поэтому память
+    не зависит от числа результатов. Параметры: format=csv|ndjson,
+    date_from и date_to (включительно), include_answers=false - без ответов"""
+    try:
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in EXPORT_MIMETYPES:
+            return jsonify({
+                'success': False,
+                'error': 'Формат выгрузки должен быть csv или ndjson'
+            }), 400
+        
+        date_from = parse_date_param('date_from')
+        date_to = parse_date_param('date_to', end_of_day=True)
+        include_answers = request.args.get('include_answers', 'true').lower() not in ('false', '0', 'no')
+        
+        if db.session.get(Test, test_id) is None:
+            return jsonify({
+                'success': False,
+                'error': 'Тест не найден'
+            }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    columns = [
+        TestResult.id, TestResult.student_name, TestResult.score, TestResult.total_questions,
+        TestResult.percentage, TestResult.time_taken, TestResult.seed, TestResult.completed_at
+    ]
+    if include_answers:
+        columns.append(TestResult.answers)
+    query = db.select(*columns).where(TestResult.test_id == test_id)
+    if date_from:
+        query = query.where(TestResult.completed_at >= date_from)
+    if date_to:
+        query = query.where(TestResult.completed_at <= date_to)
+    # yield_per включает серверный курсор: строки приходят из базы порциями
+    query = query.order_by(TestResult.completed_at, TestResult.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    names = [column.key for column in columns]
+    
+    def generate():
+        rows = db.session.execute(query)
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # BOM нужен Excel, чтобы правильно показать кириллицу
+            buffer.write('\ufeff')
+            writer.writerow(names)
+            for partition in rows.partitions():
+                for row in partition:
+                    writer.writerow([
+                        value.isoformat() if isinstance(value, datetime) else value
+                        for value in row
+                    ])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for partition in rows.partitions():
+                yield ''.join(
+                    json.dumps({
+                        name: value.isoformat() if isinstance(value, datetime) else value
+                        for name, value in zip(names, row)
+                    }, ensure_ascii=False) + '\n'
+                    for row in partition
+                )
+    
+    return Response(stream_with_context(generate()), content_type=EXPORT_MIMETYPES[export_format], headers={
+        'Content-Disposition': f'attachment; filename=test_{test_id}_results.{export_format}',
+        'X-Accel-Buffering': 'no'  # отключаем буферизацию в прокси
+    })
+
 @bp.route('/', methods=['POST'])
 @require_admin
 def create_test():
@@ -171,8 +725,12 @@ def create_test():
             title=data['title'],
             description=data.get('description', ''),
             time_limit=data.get('time_limit', 30),
-            passing_score=data.get('passing_score', 70)
+            passing_score=data.get('passing_score', 70),
+            pool_size=data.get('pool_size') or None,
+            pool_tag=data.get('pool_tag') or None
         )
+        if test.pool_size is not None and (not isinstance(test.pool_size, int) or test.pool_size < 1):
+            raise ValueError('Число вопросов варианта (pool_size) должно быть положительным целым')
         
         db.session.add(test)
         db.session.flush()  # Получаем ID теста
@@ -180,6 +738,7 @@ def create_test():
         # Добавляем вопросы, если они есть
         questions_data = data.get('questions', [])
         for question_data in questions_data:
+            is_code = question_data.get('question_type') == 'code'
             question = Question(
                 test_id=test.id,
                 question_text=question_data['question_text'],
@@ -187,10 +746,15 @@ def create_test():
                 option_b=question_data.get('option_b', ''),
                 option_c=question_data.get('option_c', ''),
                 option_d=question_data.get('option_d', ''),
-                correct_answer=question_data['correct_answer'],
+                correct_answer='' if is_code else question_data['correct_answer'],
                 explanation=question_data.get('explanation', ''),
-                order=question_data.get('order', 0)
+                order=question_data.get('order', 0),
+                question_type='code' if is_code else 'choice',
+                stop_on_failure=bool(question_data.get('stop_on_failure', False)),
+                tag=question_data.get('tag') or None
             )
+            if is_code:
+                question.test_cases = json.dumps(validate_test_cases(question_data.get('test_cases')))
             db.session.add(question)
         
         db.session.commit()
@@ -201,6 +765,12 @@ def create_test():
             'message': 'Тест успешно создан'
         }), 201
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -0,0 +1,353 @@
+"""
+Пул прогретых интерпретаторов для выполнения кода студентов.
+Каждый рабочий процесс запускается заранее, получает код по каналу
+и перезапускается после заданного числа запусков, падения или таймаута.
+Проверка решений идёт в отдельном пуле, процессы которого не выполняют
+произвольный код с /execute
+"""
+
+import ast
+import atexit
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from flask import current_app
+
+import telemetry
+from sandbox_worker import SOURCE_NAME
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox_worker.py')
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_RUNS_PER_WORKER = 50
+DEFAULT_LIMITS = {
+    'cpu': 5,                     # процессорное время одного запуска, секунды
+    'memory': 256 * 1024 * 1024,  # адресное пространство процесса, байты
+    'file_size': 1024 * 1024,     # размер создаваемого файла, байты
+    'processes': 512,             # число процессов пользователя (RLIMIT_NPROC)
+    'output': 1024 * 1024         # общий объём stdout и stderr, байты
+}
+
+
+class ExecutionTimeout(Exception):
+    """Код не уложился в отведённое время"""
+
+
+class WorkerCrashed(Exception):
+    """Рабочий процесс завершился, не вернув результат"""
+
+    def __init__(self, returncode):
+        super().__init__(f'Рабочий процесс завершился с кодом {returncode}')
+        self.returncode = returncode
+
+
+def check_syntax(code):
+    """Скомпилировать код в процессе сервера, не запуская его.
+    Возвращает дерево AST и описание синтаксической ошибки (одно из них None)"""
+    try:
+        tree = ast.parse(code, SOURCE_NAME)
+        compile(tree, SOURCE_NAME, 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return None, describe_syntax_error(e, code)
+    except (ValueError, MemoryError, RecursionError):
+        # Такой код разберёт рабочий процесс
+        return None, None
+    return tree, None
+
+
+def describe_syntax_error(error, code):
+    """Описание синтаксической ошибки: позиция, сообщение, строка с кареткой и текст как у интерпретатора"""
+    lines = code.splitlines()
+    if error.lineno and error.lineno <= len(lines):
+        # Текст строки берём из самого кода: ошибки компиляции дерева приходят без него,
+        # а токенизатор может подставить строку из одноимённого файла в текущей директории
+        error.text = lines[error.lineno - 1] + '\n'
+
+    text = (error.text or '').rstrip('\n')
+    column = error.offset or 0
+    caret = ''
+    if text and column:
+        width = 1
+        if error.end_lineno == error.lineno and error.end_offset and error.end_offset > column:
+            width = error.end_offset - column
+        caret = ' ' * (column - 1) + '^' * width
+
+    return {
+        'type': type(error).__name__,
+        'message': error.msg,
+        'line': error.lineno,
+        'column': column,
+        'text': text,
+        'caret': caret,
+        'formatted': ''.join(traceback.format_exception_only(type(error), error))
+    }
+
+
+class Worker:
+    """Один прогретый интерпретатор, с которым сервер общается через канал"""
+
+    def __init__(self, limits):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, json.dumps(limits)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+            cwd=tempfile.gettempdir(),
+            # Своя группа процессов: при остановке завершаем и всё, что запустил код студента
+            start_new_session=True
+        )
+        self.runs = 0
+        self.healthy = True
+        self._buffer = bytearray()
+
+    def execute(self, code, timeout, stdin='', **options):
+        """Отправить код рабочему процессу и дождаться результата"""
+        for message in self.stream(code, timeout, stdin, **options):
+            if message['type'] == 'result':
+                return message
+
+    def stream(self, code, timeout, stdin='', **options):
+        """Отправить код рабочему процессу и отдавать его сообщения по мере поступления"""
+        self.runs += 1
+        request = json.dumps({'code': code, 'stdin': stdin, 'timeout': timeout, **options}).encode('utf-8') + b'\n'
+        try:
+            self.process.stdin.write(request)
+        except (BrokenPipeError, OSError):
+            self.healthy = False
+            raise WorkerCrashed(self.process.wait())
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = self._read_reply(deadline)
+            except (ExecutionTimeout, WorkerCrashed):
+                self.healthy = False
+                raise
+
+            if message['type'] == 'result':
+                if message.pop('dirty', False):
+                    self.healthy = False
+                yield message
+                return
+            yield message
+
+    def cancel(self):
+        """Попросить рабочий процесс не запускать оставшиеся тестовые случаи"""
+        try:
+            self.process.stdin.write(b'{"op": "cancel"}\n')
+        except (BrokenPipeError, OSError):
+            self.healthy = False
+
+    def _read_reply(self, deadline):
+        """Прочитать одно сообщение, не дольше чем до deadline"""
+        fd = self.process.stdout.fileno()
+        scanned = 0
+        while True:
+            end = self._buffer.find(b'\n', scanned)
+            if end != -1:
+                line = bytes(self._buffer[:end])
+                del self._buffer[:end + 1]
+                return json.loads(line)
+            scanned = len(self._buffer)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ExecutionTimeout()
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                raise ExecutionTimeout()
+
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise WorkerCrashed(self.process.wait())
+            self._buffer += chunk
+
+    def stop(self):
+        """Завершить рабочий процесс вместе с его группой процессов"""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class WorkerPool:
+    """Набор готовых к работе интерпретаторов"""
+
+    def __init__(self, size, max_runs_per_worker, limits):
+        self.size = size
+        self.max_runs_per_worker = max_runs_per_worker
+        self.limits = limits
+        self.stats = telemetry.ExecutionStats()
+        self.spawned = 0  # сколько рабочих процессов запущено за время жизни пула
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def execute(self, code, timeout, stdin='', **options):
+        """Выполнить код на свободном рабочем процессе.
+        Телеметрия запуска добавляется в результат (и в ExecutionTimeout) под ключом telemetry"""
+        queued = time.monotonic()
+        worker = self._idle.get()
+        started = time.monotonic()
+        try:
+            result = worker.execute(code, timeout, stdin, **options)
+        except WorkerCrashed as e:
+            result = {'type': 'result', 'returncode': e.returncode, 'stdout': '', 'stderr': '', 'limit': None}
+        except ExecutionTimeout as e:
+            e.telemetry = self._record(queued, started, reason='timeout')
+            raise
+        finally:
+            self._release(worker)
+        result['telemetry'] = self._record(queued, started, result)
+        return result
+
+    def stream(self, code, timeout, stdin='', **options):
+        """Выполнить код на свободном рабочем процессе, отдавая вывод по мере появления"""
+        queued = time.monotonic()
+        worker = self._idle.get()
+        started = time.monotonic()
+        finished = False
+        try:
+            for message in worker.stream(code, timeout, stdin, stream=True, **options):
+                if message['type'] == 'result':
+                    finished = True
+                    message['telemetry'] = self._record(queued, started, message)
+                yield message
+        except WorkerCrashed as e:
+            finished = True
+            result = {'type': 'result', 'returncode': e.returncode, 'stdout': '', 'stderr': '', 'limit': None}
+            result['telemetry'] = self._record(queued, started, result)
+            yield result
+        except ExecutionTimeout as e:
+            finished = True
+            e.telemetry = self._record(queued, started, reason='timeout')
+            raise
+        finally:
+            # Клиент отключился посреди запуска: состояние процесса неизвестно
+            if not finished:
+                worker.healthy = False
+                self._record(queued, started, reason='disconnected')
+            self._release(worker)
+
+    def run_cases(self, code, inputs, timeout, parallel, should_stop=None):
+        """Прогнать код на наборе входных данных в одном прогретом процессе.
+        Возвращает сообщения о случаях в порядке inputs (None для незапущенных)
+        и итоговый результат; should_stop(case) может прервать оставшиеся случаи"""
+        queued = time.monotonic()
+        worker = self._idle.get()
+        started = time.monotonic()
+        cases = [None] * len(inputs)
+        # Общий срок: все "волны" параллельных случаев плюс запас на запуск
+        waves = -(-len(inputs) // parallel)
+        deadline = waves * timeout + timeout + 5
+        try:
+            for message in worker.stream(code, deadline, op='cases', inputs=inputs,
+                                         case_timeout=timeout, parallel=parallel):
+                if message['type'] == 'case':
+                    cases[message['index']] = message
+                    if should_stop and should_stop(message):
+                        worker.cancel()
+                        should_stop = None
+                else:
+                    message['telemetry'] = self._record(queued, started, message)
+                    return cases, message
+        except WorkerCrashed as e:
+            result = {'type': 'result', 'returncode': e.returncode, 'stdout': '', 'stderr': '', 'limit': None}
+            result['telemetry'] = self._record(queued, started, result)
+            return cases, result
+        except ExecutionTimeout as e:
+            e.telemetry = self._record(queued, started, reason='timeout')
+            raise
+        finally:
+            self._release(worker)
+
+    def _record(self, queued, started, result=None, reason=None):
+        """Снять телеметрию запуска и учесть её в сводке пула"""
+        measurement = telemetry.measure(queued, started, result, reason)
+        self.stats.record(measurement)
+        return measurement
+
+    def _release(self, worker):
+        """Вернуть процесс в пул или заменить его новым"""
+        if worker.healthy and worker.runs < self.max_runs_per_worker:
+            self._idle.put(worker)
+            return
+        worker.stop()
+        self._idle.put(self._spawn())
+
+    def _spawn(self):
+        """Запустить новый рабочий процесс"""
+        self.spawned += 1
+        return Worker(self.limits)
+
+    def shutdown(self):
+        """Остановить все свободные рабочие процессы"""
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_limits():
+    """Ограничения ресурсов из конфигурации приложения поверх значений по умолчанию"""
+    return {**DEFAULT_LIMITS, **current_app.config.get('COMPILER_LIMITS', {})}
+
+
+def _get_named_pool(name, size):
+    """Получить пул с данным именем, создав его при первом обращении"""
+    with _pool_lock:
+        if name not in _pools:
+            pool = WorkerPool(
+                size,
+                current_app.config.get('COMPILER_MAX_RUNS_PER_WORKER', DEFAULT_MAX_RUNS_PER_WORKER),
+                get_limits()
+            )
+            atexit.register(pool.shutdown)
+            _pools[name] = pool
+        return _pools[name]
+
+
+def execution_stats():
+    """Сводка телеметрии по всем созданным пулам"""
+    with _pool_lock:
+        pools = dict(_pools)
+    return {
+        name: {'size': pool.size, 'idle': pool._idle.qsize(), 'spawned': pool.spawned, **pool.stats.snapshot()}
+        for name, pool in pools.items()
+    }
+
+
+def get_pool():
+    """Основной пул для запусков студентов"""
+    return _get_named_pool('default', current_app.config.get('COMPILER_POOL_SIZE', DEFAULT_POOL_SIZE))
+
+
+def get_grading_pool():
+    """Отдельный пул для проверки решений: его процессы выполняют только тестовые случаи"""
+    return _get_named_pool('grading', current_app.config.get('COMPILER_GRADING_POOL_SIZE', DEFAULT_POOL_SIZE))
+
+
+def get_batch_pool():
+    """Отдельный пул для пакетных проверок: по процессу на ядро, чтобы не мешать студентам"""
+    return _get_named_pool('batch', current_app.config.get('COMPILER_BATCH_POOL_SIZE', os.cpu_count() or 1))
@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+"""
+Рабочий процесс песочницы компилятора.
+Получает задания по каналу, выполняет код в копии процесса (fork) с чистым
+пространством имён и возвращает вывод в том же виде, что и отдельный запуск
+интерпретатора. Сам рабочий процесс код студента не выполняет (кроме ячеек
+интерактивной сессии), поэтому изменения модулей, окружения и хуков трассировки
+пропадают вместе с копией и не достаются следующему заданию
+"""
+
+import ast
+import builtins
+import collections
+import errno
+import io
+import json
+import linecache
+import math
+import os
+import resource
+import select
+import signal
+import sys
+import tempfile
+import time
+import traceback
+import types
+
+# Имя, под которым код студента виден в трассировках
+SOURCE_NAME = 'main.py'
+# prctl: осиротевшие потомки становятся детьми этого процесса, а не init
+PR_SET_CHILD_SUBREAPER = 36
+
+
+def open_channel():
+    """Перенести канал связи на отдельные дескрипторы, чтобы код студента не мог его испортить"""
+    requests = Requests(os.dup(0))
+    replies = os.fdopen(os.dup(1), 'wb')
+
+    # Стандартные дескрипторы больше не связаны с сервером
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+    return requests, replies
+
+
+class Requests:
+    """Задания от сервера, по одному JSON-объекту в строке.
+    Читаем дескриптор напрямую, чтобы его можно было передать в select"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self._buffer = bytearray()
+
+    def fileno(self):
+        return self.fd
+
+    def _take_line(self):
+        end = self._buffer.find(b'\n')
+        if end == -1:
+            return None
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end + 1]
+        return json.loads(line)
+
+    def poll(self):
+        """Дочитать то, что уже пришло, и вернуть задание, если оно получено целиком"""
+        request = self._take_line()
+        if request is None:
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                raise EOFError()
+            self._buffer += chunk
+            request = self._take_line()
+        return request
+
+    def get(self):
+        """Дождаться следующего задания"""
+        while True:
+            request = self.poll()
+            if request is not None:
+                return request
+
+
+def apply_limits(limits):
+    """Установить ограничения процесса так, чтобы код студента не мог их снять"""
+    # При превышении размера файла запись завершается ошибкой, а не сигналом
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+
+    for limit, value in (
+        (resource.RLIMIT_AS, limits.get('memory')),
+        (resource.RLIMIT_FSIZE, limits.get('file_size')),
+        (resource.RLIMIT_NPROC, limits.get('processes'))
+    ):
+        if value is None:
+            continue
+        _, hard = resource.getrlimit(limit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(limit, (value, value))
+
+
+def become_subreaper():
+    """Забирать себе осиротевших потомков, чтобы после запуска их можно было завершить.
+    Работает только в Linux; в остальных системах завершаются только прямые потомки"""
+    try:
+        import ctypes
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+
+def child_pids():
+    """Дочерние процессы рабочего процесса по /proc (только Linux, иначе пустой список)"""
+    pids = []
+    try:
+        for task in os.listdir('/proc/self/task'):
+            with open(f'/proc/self/task/{task}/children') as f:
+                pids.extend(int(pid) for pid in f.read().split())
+    except (OSError, ValueError):
+        pass
+    return pids
+
+
+def kill_strays():
+    """Завершить процессы, которые код студента оставил после себя, и дождаться их"""
+    while True:
+        pids = child_pids()
+        if not pids:
+            break
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+    # Уже завершившиеся потомки, если /proc недоступен
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if not pid:
+            break
+
+
+def set_cpu_budget(seconds):
+    """Разрешить текущему запуску потратить не больше seconds процессорного времени.
+    Лимит процесса накопительный, поэтому отсчитываем его от уже потраченного"""
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def reset_peak_memory():
+    """Сбросить пиковый объём резидентной памяти процесса, чтобы мерить его для каждого запуска.
+    Работает только в Linux; в остальных системах пик считается с начала жизни процесса"""
+    try:
+        fd = os.open('/proc/self/clear_refs', os.O_WRONLY)
+    except OSError:
+        return
+    try:
+        os.write(fd, b'5')
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def memory_status_kb(field):
+    """Значение поля памяти из /proc/self/status в килобайтах (только Linux, иначе None)"""
+    try:
+        fd = os.open('/proc/self/status', os.O_RDONLY)
+        try:
+            status = os.read(fd, 65536)
+        finally:
+            os.close(fd)
+        for line in status.splitlines():
+            if line.startswith(field + b':'):
+                return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def peak_memory_kb():
+    """Пиковый объём резидентной памяти процесса в килобайтах"""
+    peak = memory_status_kb(b'VmHWM')
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS ru_maxrss в байтах, в Linux - в килобайтах
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def cpu_times():
+    """Процессорное время (user, sys) процесса и его завершившихся потомков"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime
+
+
+class Usage:
+    """Ресурсы, потраченные одним запуском"""
+
+    def __init__(self):
+        reset_peak_memory()
+        self.start = cpu_times()
+        self.peak_rss_kb = 0
+
+    def report(self):
+        user, system = cpu_times()
+        return {
+            'cpu_user_ms': round((user - self.start[0]) * 1000, 2),
+            'cpu_sys_ms': round((system - self.start[1]) * 1000, 2),
+            'peak_rss_kb': max(self.peak_rss_kb, peak_memory_kb())
+        }
+
+
+def limit_for(exc):
+    """Какой лимит ресурсов привёл к исключению (или None)"""
+    if isinstance(exc, MemoryError):
+        return 'memory'
+    if isinstance(exc, OSError) and exc.errno == errno.EFBIG:
+        return 'file_size'
+    if isinstance(exc, OSError) and exc.errno == errno.EAGAIN:
+        # Так завершается fork при исчерпании лимита процессов
+        return 'processes'
+    return None
+
+
+def exit_code(exc, stderr):
+    """Код возврата для SystemExit по тем же правилам, что и у интерпретатора"""
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    stderr.write(f'{exc.code}\n')
+    return 1
+
+
+class Snapshot:
+    """Состояние интерпретатора, которое восстанавливается после каждой ячейки сессии"""
+
+    def __init__(self):
+        self.builtins = dict(vars(builtins))
+        self.path = list(sys.path)
+        self.argv = list(sys.argv)
+        self.cwd = os.getcwd()
+        self.main = sys.modules['__main__']
+        self.recursion_limit = sys.getrecursionlimit()
+        self.pid = os.getpid()
+
+    def restore(self):
+        """Вернуть интерпретатор в исходное состояние"""
+        sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, sys.__stdout__, sys.__stderr__
+        current = vars(builtins)
+        for name in set(current) - set(self.builtins):
+            del current[name]
+        current.update(self.builtins)
+        sys.path[:] = self.path
+        sys.argv[:] = self.argv
+        sys.modules['__main__'] = self.main
+        sys.setrecursionlimit(self.recursion_limit)
+        os.chdir(self.cwd)
+
+
+def is_dirty():
+    """Остались ли после ячейки фоновые потоки, из-за которых процесс нельзя переиспользовать"""
+    threading = sys.modules.get('threading')
+    return threading is not None and threading.active_count() > 1
+
+
+class Channel:
+    """Канал сообщений серверу, по одному JSON-объекту в строке"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def send(self, message):
+        self.file.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.file.flush()
+
+
+class Output(io.TextIOBase):
+    """Поток вывода кода студента: копит текст или построчно отправляет его серверу"""
+
+    encoding = 'utf-8'
+
+    def __init__(self, name, run):
+        super().__init__()
+        self.name = name
+        self._run = run
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f'write() argument must be str, not {type(text).__name__}')
+        accepted, exceeded = self._run.accept(text)
+        self._parts.append(accepted)
+        # В потоковом режиме вывод уходит построчно, как в терминале
+        if self._run.streaming and ('\n' in accepted or exceeded):
+            self.flush()
+        if exceeded:
+            self._run.abort('output')
+        return len(text)
+
+    def flush(self):
+        if self._run.streaming and self._parts:
+            self._run.channel.send({'type': 'output', 'stream': self.name, 'data': ''.join(self._parts)})
+            self._parts.clear()
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
+class Run:
+    """Один запуск кода: потоки вывода, общий лимит вывода и итоговый результат"""
+
+    def __init__(self, channel, streaming=False, max_output=None):
+        self.channel = channel
+        self.streaming = streaming
+        self.max_output = max_output
+        self.used = 0
+        self.stdout = Output('stdout', self)
+        self.stderr = Output('stderr', self)
+        self.usage = Usage()
+
+    def accept(self, text):
+        """Обрезать текст по оставшемуся лимиту вывода"""
+        if self.max_output is None:
+            return text, False
+        data = text.encode('utf-8', 'replace')
+        remaining = self.max_output - self.used
+        if len(data) <= remaining:
+            self.used += len(data)
+            return text, False
+        self.used = self.max_output
+        return data[:remaining].decode('utf-8', 'ignore'), True
+
+    def result(self, returncode, **extra):
+        """Итоговое сообщение о запуске"""
+        self.stdout.flush()
+        self.stderr.flush()
+        return {
+            'type': 'result',
+            'returncode': returncode,
+            'stdout': self.stdout.getvalue(),
+            'stderr': self.stderr.getvalue(),
+            'usage': self.usage.report(),
+            **extra
+        }
+
+    def abort(self, limit):
+        """Лимит исчерпан: отправить то, что есть, и завершить процесс"""
+        self.channel.send(self.result(None, limit=limit, dirty=True))
+        os._exit(0)
+
+
+def execute(compiled, run, stdin, limits, module=None):
+    """Выполнить скомпилированный код (объект кода или их список) в модуле __main__;
+    вернуть код возврата и исчерпанный лимит. Без module создаётся новый модуль"""
+    if module is None:
+        module = types.ModuleType('__main__')
+        module.__file__ = SOURCE_NAME
+    sys.modules['__main__'] = module
+    sys.stdin = io.StringIO(stdin)
+    sys.stdout, sys.stderr = run.stdout, run.stderr
+    signal.signal(signal.SIGXCPU, lambda signum, frame: run.abort('cpu'))
+    set_cpu_budget(limits.get('cpu'))
+    try:
+        for code in compiled if isinstance(compiled, list) else [compiled]:
+            exec(code, module.__dict__)
+    except SystemExit as e:
+        return exit_code(e, run.stderr), None
+    except BaseException as e:
+        # Пропускаем кадр самого рабочего процесса
+        run.stderr.write(''.join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+        return 1, limit_for(e)
+    return 0, None
+
+
+def compile_code(code, run, filename=SOURCE_NAME, interactive=False):
+    """Скомпилировать код; при синтаксической ошибке записать её в stderr и вернуть None.
+    В интерактивном режиме значение последнего выражения выводится, как в консоли Python,
+    поэтому результат - список объектов кода"""
+    lines = code.splitlines(True)
+    linecache.cache[filename] = (len(code), None, lines, filename)
+    try:
+        if not interactive:
+            return compile(code, filename, 'exec')
+        tree = ast.parse(code, filename)
+        last = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last = ast.Interactive(body=[tree.body.pop()])
+        compiled = [compile(tree, filename, 'exec')]
+        if last is not None:
+            compiled.append(compile(last, filename, 'single'))
+        return compiled
+    except SyntaxError as e:
+        if e.lineno and e.lineno <= len(lines):
+            # Иначе токенизатор может подставить строку из одноимённого файла в текущей директории
+            e.text = lines[e.lineno - 1]
+        # Как и интерпретатор, сообщаем об ошибке синтаксиса без трассировки
+        run.stderr.write(''.join(traceback.format_exception_only(type(e), e)))
+        return None
+
+
+def capture_fds():
+    """Направить дескрипторы 1 и 2 копии во временные файлы: туда пишут os.system,
+    subprocess и os.write, минуя sys.stdout и sys.stderr"""
+    files = []
+    for fd in (1, 2):
+        file = tempfile.TemporaryFile()
+        os.dup2(file.fileno(), fd)
+        files.append(file)
+    return files
+
+
+def collect_fds(files, run):
+    """Добавить вывод с дескрипторов 1 и 2 к выводу запуска (с учётом лимита вывода)"""
+    for file, stream in zip(files, (run.stdout, run.stderr)):
+        file.seek(0)
+        # Сверх лимита читать незачем: хватит байта, чтобы заметить превышение
+        data = file.read(-1 if run.max_output is None else run.max_output - run.used + 1)
+        if data:
+            stream.write(data.decode('utf-8', 'replace'))
+
+
+def run_code(request, snapshot, channel, limits, session):
+    """Выполнить ячейку в модуле интерактивной сессии и собрать её вывод.
+    Ячейки выполняются в самом рабочем процессе, чтобы сохранять состояние; процесс
+    принадлежит одному владельцу сессии и в пул не возвращается"""
+    run = Run(channel, request.get('stream', False), limits.get('output'))
+    compiled = compile_code(request['code'], run, f'<cell {request.get("cell", 0)}>', interactive=True)
+    if compiled is None:
+        return run.result(1, limit=None)
+
+    returncode, limit = 1, None
+    try:
+        returncode, limit = execute(compiled, run, request.get('stdin', ''), limits, session)
+    finally:
+        if os.getpid() != snapshot.pid:
+            # Копия, созданная os.fork() в коде студента, не должна вернуться в цикл заданий
+            os._exit(returncode)
+        set_cpu_budget(None)
+        snapshot.restore()
+        kill_strays()
+
+    # После исчерпания лимита состояние процесса ненадёжно, его лучше заменить
+    result = run.result(returncode, limit=limit, dirty=limit is not None or is_dirty())
+    # Сервер закрывает сессии, которые держат слишком много памяти
+    result['rss_kb'] = memory_status_kb(b'VmRSS') or result['usage']['peak_rss_kb']
+    return result
+
+
+def run_forked(request, requests, channel, limits):
+    """Выполнить код в копии рабочего процесса и переслать серверу её сообщения.
+    Копия не видит канала заданий, а после её завершения убираются и все запущенные
+    ею процессы, так что следующий запуск получает нетронутый интерпретатор"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        # Дочерний процесс: канал сервера ему не нужен, как и чужие задания в нём
+        os.close(read_fd)
+        os.close(requests.fileno())
+        os.close(channel.file.fileno())
+        if request.get('timeout'):
+            # Страховка на случай, если сервер не успеет остановить запуск
+            signal.alarm(math.ceil(request['timeout']) + 1)
+
+        child = os.getpid()
+        captured = capture_fds()
+        run = Run(Channel(os.fdopen(write_fd, 'wb')), request.get('stream', False), limits.get('output'))
+        returncode, limit = 1, None
+        try:
+            compiled = compile_code(request['code'], run)
+            if compiled is not None:
+                returncode, limit = execute(compiled, run, request.get('stdin', ''), limits)
+        finally:
+            if os.getpid() == child:
+                collect_fds(captured, run)
+                run.channel.send(run.result(returncode, limit=limit))
+            os._exit(0)
+
+    os.close(write_fd)
+    result = None
+    buffer = b''
+    with os.fdopen(read_fd, 'rb') as replies:
+        while result is None:
+            chunk = replies.read1(65536)
+            if not chunk:
+                break
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+                if message.get('type') == 'result':
+                    result = message
+                    break
+                channel.send(message)
+
+    _, status, usage = os.wait4(pid, 0)
+    kill_strays()
+    if result is None:
+        # Копия погибла, не дописав результат: остаётся код возврата
+        result = {
+            'type': 'result',
+            'returncode': -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status),
+            'stdout': '',
+            'stderr': '',
+            'limit': 'timeout' if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGALRM else None,
+            'usage': {
+                'cpu_user_ms': round(usage.ru_utime * 1000, 2),
+                'cpu_sys_ms': round(usage.ru_stime * 1000, 2),
+                'peak_rss_kb': usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+            }
+        }
+    # Рабочий процесс код не выполнял, поэтому и после лимита остаётся чистым
+    result.pop('dirty', None)
+    # Сколько копий процесса создано для задания (для телеметрии)
+    result['forks'] = 1
+    return result
+
+
+def start_case(compiled, stdin, timeout, limits, inherited):
+    """Запустить один тестовый случай в копии рабочего процесса.
+    Копия создаётся через fork, поэтому прогретый интерпретатор не перезапускается,
+    а сам рабочий процесс не выполняет код студента и остаётся чистым"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(write_fd)
+        return pid, read_fd
+
+    # Дочерний процесс: канал сервера и чужие тестовые случаи ему не нужны
+    os.close(read_fd)
+    for fd in inherited:
+        os.close(fd)
+    # Страховка на случай, если рабочий процесс не успеет его остановить
+    signal.alarm(math.ceil(timeout) + 1)
+
+    child = os.getpid()
+    captured = capture_fds()
+    run = Run(Channel(os.fdopen(write_fd, 'wb')), False, limits.get('output'))
+    returncode, limit = 1, None
+    try:
+        returncode, limit = execute(compiled, run, stdin, limits)
+    finally:
+        if os.getpid() == child:
+            collect_fds(captured, run)
+            run.channel.send(run.result(returncode, limit=limit))
+        os._exit(0)
+
+
+def finish_case(case, limit=None):
+    """Дождаться завершения тестового случая и собрать сообщение о нём"""
+    os.close(case['fd'])
+    _, status, usage = os.wait4(case['pid'], 0)
+    message = {
+        'type': 'case',
+        'index': case['index'],
+        'returncode': -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status),
+        'stdout': '',
+        'stderr': '',
+        'limit': limit,
+        'duration_ms': round((time.monotonic() - case['started']) * 1000, 2),
+        'usage': {
+            'cpu_user_ms': round(usage.ru_utime * 1000, 2),
+            'cpu_sys_ms': round(usage.ru_stime * 1000, 2),
+            'peak_rss_kb': usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+        }
+    }
+    if os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGALRM:
+        message['limit'] = 'timeout'
+    elif limit is None and case['buffer']:
+        try:
+            result = json.loads(bytes(case['buffer']))
+        except ValueError:
+            # Процесс погиб, не дописав результат: остаётся код возврата
+            return message
+        for name in ('returncode', 'stdout', 'stderr', 'limit'):
+            message[name] = result[name]
+    return message
+
+
+def run_cases(request, requests, channel, limits):
+    """Прогнать код на наборе входных данных: каждый случай в своей копии процесса,
+    не больше parallel одновременно и не дольше timeout секунд каждый.
+    Сервер может прислать {"op": "cancel"}, чтобы не запускать оставшиеся случаи"""
+    run = Run(channel, False, limits.get('output'))
+    compiled = compile_code(request['code'], run)
+    if compiled is None:
+        return run.result(1, limit=None)
+
+    inputs = request['inputs']
+    timeout = request['case_timeout']
+    parallel = max(1, request.get('parallel', 1))
+    pending = collections.deque(range(len(inputs)))
+    running = {}
+    cancelled = False
+    forks = 0
+
+    def track(message):
+        # Пик памяти всего прогона - наибольший среди случаев
+        run.usage.peak_rss_kb = max(run.usage.peak_rss_kb, message['usage']['peak_rss_kb'])
+        return message
+
+    while running or (pending and not cancelled):
+        while pending and not cancelled and len(running) < parallel:
+            index = pending.popleft()
+            inherited = [requests.fileno(), channel.file.fileno(), *running]
+            pid, fd = start_case(compiled, inputs[index], timeout, limits, inherited)
+            forks += 1
+            now = time.monotonic()
+            running[fd] = {
+                'index': index, 'pid': pid, 'fd': fd, 'buffer': bytearray(),
+                'started': now, 'deadline': now + timeout
+            }
+
+        wait = max(0, min(case['deadline'] for case in running.values()) - time.monotonic())
+        ready, _, _ = select.select([requests.fileno(), *running], [], [], wait)
+
+        for fd in ready:
+            if fd == requests.fileno():
+                command = requests.poll()
+                if command is not None and command.get('op') == 'cancel':
+                    cancelled = True
+                    for case in running.values():
+                        os.kill(case['pid'], signal.SIGKILL)
+                        track(finish_case(case, limit='cancelled'))
+                    running.clear()
+                    break
+                continue
+            case = running[fd]
+            chunk = os.read(fd, 65536)
+            if chunk:
+                case['buffer'] += chunk
+            else:
+                channel.send(track(finish_case(running.pop(fd))))
+
+        now = time.monotonic()
+        for fd, case in list(running.items()):
+            if case['deadline'] <= now:
+                os.kill(case['pid'], signal.SIGKILL)
+                channel.send(track(finish_case(running.pop(fd), limit='timeout')))
+
+    return run.result(0, limit=None, cancelled=cancelled, forks=forks)
+
+
+def main():
+    """Цикл обработки заданий до закрытия канала сервером"""
+    requests, replies = open_channel()
+    channel = Channel(replies)
+    limits = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+
+    # Код студента запускается из временной директории, как и отдельный скрипт раньше
+    workdir = tempfile.gettempdir()
+    os.chdir(workdir)
+    sys.path[0] = workdir
+    snapshot = Snapshot()
+    apply_limits(limits)
+    become_subreaper()
+    # Пространство имён интерактивной сессии создаётся первой ячейкой
+    session = None
+
+    while True:
+        try:
+            request = requests.get()
+        except EOFError:
+            break
+        op = request.get('op', 'run')
+        if op == 'run':
+            channel.send(run_forked(request, requests, channel, limits))
+        elif op == 'cell':
+            if session is None:
+                session = types.ModuleType('__main__')
+                session.__file__ = SOURCE_NAME
+            channel.send(run_code(request, snapshot, channel, limits, session))
+        elif op == 'cases':
+            result = run_cases(request, requests, channel, limits)
+            kill_strays()
+            channel.send(result)
+        # Отмена, пришедшая после завершения задания, просто игнорируется
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Интерактивные сессии компилятора.
+У вошедшего пользователя может быть один долгоживущий интерпретатор, который
+выполняет ячейки по очереди и сохраняет состояние между ними. Сессия закрывается
+после простоя или при превышении памяти. Когда открытых сессий уже max_sessions,
+новая не открывается (чужие сессии не вытесняются), а открывать сессии чаще
+create_limit раз за create_window секунд один пользователь не может
+"""
+
+import atexit
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+
+from flask import current_app
+
+import sandbox
+import telemetry
+
+# Значения по умолчанию, если в конфигурации приложения ничего не задано
+DEFAULT_MAX_SESSIONS = 20
+DEFAULT_SESSION_IDLE_TIMEOUT = 600  # секунд без ячеек до закрытия сессии
+DEFAULT_SESSION_MAX_MEMORY = 128 * 1024 * 1024  # резидентная память интерпретатора, байты
+DEFAULT_SESSION_CREATE_LIMIT = 5  # открытий сессии одним пользователем за окно
+DEFAULT_SESSION_CREATE_WINDOW = 60  # окно ограничения частоты, секунд
+
+
+class SessionBusy(Exception):
+    """В сессии уже выполняется ячейка"""
+
+
+class SessionClosed(Exception):
+    """Сессия закрыта и больше не принимает ячейки"""
+
+
+class SessionLimitReached(Exception):
+    """Открыто максимальное число сессий"""
+
+
+class SessionRateLimited(Exception):
+    """Пользователь слишком часто открывает сессии"""
+
+
+class Session:
+    """Один интерпретатор, принадлежащий пользователю"""
+
+    def __init__(self, owner, limits):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.worker = sandbox.Worker(limits)
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.cells = 0
+        self.rss_kb = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'created_at': self.created_at,
+            'cells': self.cells,
+            'rss_kb': self.rss_kb,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1)
+        }
+
+
+class SessionManager:
+    """Открытые сессии в порядке от давно не использованных к недавним"""
+
+    def __init__(self, max_sessions, idle_timeout, max_memory, limits,
+                 create_limit=DEFAULT_SESSION_CREATE_LIMIT, create_window=DEFAULT_SESSION_CREATE_WINDOW):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_memory = max_memory
+        self.limits = limits
+        self.create_limit = create_limit
+        self.create_window = create_window
+        self.closed = Counter()
+        self.rejected = Counter()
+        self.stats = telemetry.ExecutionStats()
+        self._sessions = OrderedDict()
+        self._starting = 0  # сессий, процессы которых сейчас запускаются
+        self._created = {}  # владелец -> время недавних открытий сессий
+        self._lock = threading.Lock()
+
+        # Простаивающие сессии закрываем в фоне, иначе их процессы жили бы до следующего запроса
+        reaper = threading.Thread(target=self._reap, name='compiler-session-reaper', daemon=True)
+        reaper.start()
+
+    def create(self, owner):
+        """Открыть сессию; прежняя сессия того же владельца закрывается.
+        SessionRateLimited - владелец открывает сессии слишком часто,
+        SessionLimitReached - все места заняты сессиями других владельцев"""
+        with self._lock:
+            self._check_rate(owner)
+            own = sum(1 for existing in self._sessions.values() if existing.owner == owner)
+            if len(self._sessions) - own + self._starting >= self.max_sessions:
+                self.rejected['full'] += 1
+                raise SessionLimitReached()
+            # Место занято, пока процесс запускается без блокировки
+            self._starting += 1
+
+        try:
+            session = Session(owner, self.limits)
+        finally:
+            with self._lock:
+                self._starting -= 1
+
+        replaced = []
+        with self._lock:
+            for existing in list(self._sessions.values()):
+                if existing.owner == owner:
+                    del self._sessions[existing.id]
+                    replaced.append(existing)
+            self._sessions[session.id] = session
+
+        for existing in replaced:
+            self._close(existing, 'replaced')
+        return session
+
+    def _check_rate(self, owner):
+        """Учесть открытие сессии владельцем или отказать (вызывается под _lock)"""
+        now = time.monotonic()
+        created = self._created.setdefault(owner, deque())
+        while created and created[0] <= now - self.create_window:
+            created.popleft()
+        if len(created) >= self.create_limit:
+            self.rejected['rate'] += 1
+            raise SessionRateLimited()
+        created.append(now)
+
+    def get(self, session_id, owner):
+        """Получить сессию владельца или None"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or session.owner != owner:
+            return None
+        return session
+
+    def close(self, session, reason='closed'):
+        """Закрыть сессию"""
+        with self._lock:
+            if self._sessions.get(session.id) is not session:
+                return
+            del self._sessions[session.id]
+        self._close(session, reason)
+
+    def run_cell(self, session, code, timeout):
+        """Выполнить ячейку в сессии и вернуть результат рабочего процесса.
+        Если после ячейки сессию пришлось закрыть, в результате есть session_closed с причиной"""
+        if not session.lock.acquire(blocking=False):
+            raise SessionBusy()
+        try:
+            with self._lock:
+                if session.closed:
+                    raise SessionClosed()
+                self._sessions.move_to_end(session.id)
+            session.cells += 1
+            session.last_used = started = time.monotonic()
+
+            try:
+                result = session.worker.execute(code, timeout, op='cell', cell=session.cells)
+            except sandbox.WorkerCrashed as e:
+                result = {'type': 'result', 'returncode': e.returncode, 'stdout': '', 'stderr': '', 'limit': None}
+            except sandbox.ExecutionTimeout as e:
+                e.telemetry = self._record(started, reason='timeout')
+                self.close(session, 'timeout')
+                raise
+
+            result['telemetry'] = self._record(started, result)
+            session.last_used = time.monotonic()
+            session.rss_kb = result.pop('rss_kb', None)
+
+            # После лимита или падения состояние интерпретатора ненадёжно
+            if session.closed:
+                result['session_closed'] = 'evicted'
+            elif not session.worker.healthy:
+                result['session_closed'] = result['limit'] or 'crashed'
+            elif session.rss_kb and session.rss_kb * 1024 > self.max_memory:
+                result['session_closed'] = 'memory'
+            if 'session_closed' in result:
+                self.close(session, result['session_closed'])
+            return result
+        finally:
+            session.lock.release()
+            self._stop_if_closed(session)
+
+    def evict_idle(self):
+        """Закрыть сессии, простаивающие дольше idle_timeout"""
+        expired_before = time.monotonic() - self.idle_timeout
+        with self._lock:
+            # Заодно забываем владельцев, давно не открывавших сессий
+            for owner in [owner for owner, created in self._created.items()
+                          if not created or created[-1] <= time.monotonic() - self.create_window]:
+                del self._created[owner]
+            expired = [
+                session for session in self._sessions.values()
+                if session.last_used < expired_before and not session.lock.locked()
+            ]
+            for session in expired:
+                del self._sessions[session.id]
+        for session in expired:
+            self._close(session, 'idle')
+
+    def snapshot(self):
+        """Сводка: открытые сессии, причины закрытия и телеметрия ячеек"""
+        with self._lock:
+            live = len(self._sessions)
+            closed = dict(self.closed)
+            rejected = dict(self.rejected)
+        return {
+            'live': live,
+            'max_sessions': self.max_sessions,
+            'closed': closed,
+            'rejected': rejected,
+            **self.stats.snapshot()
+        }
+
+    def shutdown(self):
+        """Закрыть все сессии"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            self._close(session, 'shutdown')
+
+    def _reap(self):
+        """Фоновый поток: периодически закрывать простаивающие сессии"""
+        interval = max(1, min(60, self.idle_timeout / 4))
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+
+    def _close(self, session, reason):
+        """Остановить процесс уже удалённой из списка сессии"""
+        session.closed = True
+        with self._lock:
+            self.closed[reason] += 1
+        if session.lock.locked():
+            # Ячейка ещё выполняется: прерываем её, а процесс остановит run_cell
+            session.worker.process.kill()
+        self._stop_if_closed(session)
+
+    def _stop_if_closed(self, session):
+        """Остановить процесс закрытой сессии, если в ней ничего не выполняется"""
+        if session.closed and session.lock.acquire(blocking=False):
+            try:
+                session.worker.stop()
+            finally:
+                session.lock.release()
+
+    def _record(self, started, result=None, reason=None):
+        measurement = telemetry.measure(started, started, result, reason)
+        self.stats.record(measurement)
+        return measurement
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Получить менеджер сессий процесса, создав его при первом обращении"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionManager(
+                current_app.config.get('COMPILER_MAX_SESSIONS', DEFAULT_MAX_SESSIONS),
+                current_app.config.get('COMPILER_SESSION_IDLE_TIMEOUT', DEFAULT_SESSION_IDLE_TIMEOUT),
+                current_app.config.get('COMPILER_SESSION_MAX_MEMORY', DEFAULT_SESSION_MAX_MEMORY),
+                sandbox.get_limits(),
+                current_app.config.get('COMPILER_SESSION_CREATE_LIMIT', DEFAULT_SESSION_CREATE_LIMIT),
+                current_app.config.get('COMPILER_SESSION_CREATE_WINDOW', DEFAULT_SESSION_CREATE_WINDOW)
+            )
+            atexit.register(_manager.shutdown)
+    return _manager
@@ -0,0 +1,134 @@
+"""
+Телеметрия запусков кода.
+Для каждого запуска собираются время ожидания в очереди, полное время,
+процессорное время, пик памяти, причина завершения и число копий процесса
+(fork), созданных для запуска, а сводка хранится в виде гистограмм и счётчиков
+для планирования мощности компилятора
+"""
+
+import bisect
+import threading
+import time
+from collections import Counter
+
+# Границы корзин гистограмм (верхние, включительно)
+TIME_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+QUEUE_WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+MEMORY_BUCKETS_MB = (8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def exit_reason(result):
+    """Почему завершился запуск: ok, error, crashed или имя исчерпанного лимита"""
+    if result.get('limit'):
+        return result['limit']
+    if result['returncode'] is None or result['returncode'] < 0:
+        return 'crashed'
+    return 'ok' if result['returncode'] == 0 else 'error'
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и оценкой перцентилей"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Оценка перцентиля: линейная интерполяция внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                upper = min(upper, self.max)
+                return round(lower + (upper - lower) * (rank - seen) / count, 2)
+            seen += count
+        return self.max
+
+    def snapshot(self):
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('inf',), self.counts):
+            cumulative += count
+            buckets.append({'le': bound, 'count': cumulative})
+        return {
+            'count': self.count,
+            'sum': round(self.total, 2),
+            'mean': round(self.total / self.count, 2) if self.count else None,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': buckets
+        }
+
+
+class ExecutionStats:
+    """Сводка по запускам одного пула рабочих процессов"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.exit_reasons = Counter()
+        self.forks = 0  # копий рабочих процессов, созданных для запусков
+        self.histograms = {
+            'wall_ms': Histogram(TIME_BUCKETS_MS),
+            'queue_wait_ms': Histogram(QUEUE_WAIT_BUCKETS_MS),
+            'cpu_ms': Histogram(TIME_BUCKETS_MS),
+            'peak_rss_mb': Histogram(MEMORY_BUCKETS_MB)
+        }
+        self._lock = threading.Lock()
+
+    def record(self, measurement):
+        """Учесть один запуск (словарь, который возвращает measure)"""
+        values = {
+            'wall_ms': measurement['wall_ms'],
+            'queue_wait_ms': measurement['queue_wait_ms']
+        }
+        if measurement['cpu_user_ms'] is not None:
+            values['cpu_ms'] = measurement['cpu_user_ms'] + measurement['cpu_sys_ms']
+        if measurement['peak_rss_kb'] is not None:
+            values['peak_rss_mb'] = measurement['peak_rss_kb'] / 1024
+
+        with self._lock:
+            self.exit_reasons[measurement['exit_reason']] += 1
+            self.forks += measurement['forks'] or 0
+            for name, value in values.items():
+                self.histograms[name].observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self.started_at,
+                'runs': sum(self.exit_reasons.values()),
+                'exit_reasons': dict(self.exit_reasons),
+                'forks': self.forks,
+                'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+            }
+
+
+def measure(queued, started, result=None, reason=None):
+    """Телеметрия одного запуска по моментам постановки в очередь и начала выполнения
+    (time.monotonic()) и итоговому сообщению рабочего процесса"""
+    usage = (result or {}).pop('usage', None) or {}
+    forks = (result or {}).pop('forks', None)
+    return {
+        'queue_wait_ms': round((started - queued) * 1000, 2),
+        'wall_ms': round((time.monotonic() - started) * 1000, 2),
+        'cpu_user_ms': usage.get('cpu_user_ms'),
+        'cpu_sys_ms': usage.get('cpu_sys_ms'),
+        'peak_rss_kb': usage.get('peak_rss_kb'),
+        'forks': forks,
+        'exit_reason': reason or exit_reason(result)
+    }
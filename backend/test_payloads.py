@@ -0,0 +1,58 @@
+"""
+Готовые ответы для студентов: список тестов и тесты целиком.
+Когда сотни студентов одновременно открывают один тест, каждый запрос
+заново загружал бы объекты из базы и сериализовал их в JSON. Здесь JSON
+собирается один раз, сразу сжимается и хранится в памяти в виде байтов,
+а пересобирается, только когда меняется версия теста (или набор тестов)
+"""
+
+import gzip
+import threading
+
+from flask import current_app
+
+# Степень сжатия: ответ сжимается один раз, поэтому можно не экономить
+COMPRESS_LEVEL = 9
+
+
+class Blob:
+    """Сериализованный ответ: исходный JSON и сжатый gzip"""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.gzipped = gzip.compress(body, COMPRESS_LEVEL)
+
+
+_blobs = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'builds': 0}
+
+
+def get_blob(key, version, build):
+    """Готовый ответ для key в версии version; build() строит данные ответа,
+    если ответа нет или он собран для другой версии"""
+    with _lock:
+        blob = _blobs.get(key)
+        if blob is not None and blob.version == version:
+            _stats['hits'] += 1
+            return blob
+
+    # Тот же JSON, что вернул бы jsonify
+    body = current_app.json.response(build()).get_data()
+    blob = Blob(version, body)
+    with _lock:
+        _blobs[key] = blob
+        _stats['builds'] += 1
+    return blob
+
+
+def stats():
+    """Число готовых ответов, их объём и попадания"""
+    with _lock:
+        return {
+            'blobs': len(_blobs),
+            'bytes': sum(len(blob.body) for blob in _blobs.values()),
+            'gzipped_bytes': sum(len(blob.gzipped) for blob in _blobs.values()),
+            **_stats
+        }
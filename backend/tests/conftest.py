@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+# Модули бэкенда импортируются по имени, как при запуске app.py из этой директории
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import test_payloads  # noqa: E402
+from models import db, init_db  # noqa: E402
+from routes import admin, auth, compiler, lectures, tests, users  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Приложение с теми же маршрутами, что и app.py, на SQLite в памяти"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SECRET_KEY'] = 'test'
+    app.config['TESTING'] = True
+    init_db(app)
+    for module in (lectures, tests, admin, auth, users, compiler):
+        app.register_blueprint(module.bp)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    # Готовые ответы кэшируются в памяти процесса по версии, а id в новой базе начинаются заново
+    test_payloads._blobs.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
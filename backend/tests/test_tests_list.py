@@ -0,0 +1,44 @@
+from sqlalchemy import event
+
+from models import db
+
+
+def create_tests(client, count, start=0):
+    for i in range(start, start + count):
+        response = client.post('/api/tests/', json={
+            'title': f'Тест {i}',
+            'questions': [
+                {'question_text': f'Вопрос {j}', 'option_a': '1', 'correct_answer': 'A'}
+                for j in range(i % 4 + 1)
+            ]
+        })
+        assert response.status_code == 201
+
+
+def count_queries(client, url):
+    """Число SQL-запросов, выполненных за один GET url"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    assert response.status_code == 200
+    return len(statements), response.get_json()['data']
+
+
+def test_list_query_count_does_not_depend_on_number_of_tests(client):
+    create_tests(client, 3)
+    few_queries, few = count_queries(client, '/api/tests/')
+
+    create_tests(client, 30, start=3)
+    many_queries, many = count_queries(client, '/api/tests/')
+
+    assert len(few) == 3
+    assert len(many) == 33
+    assert many_queries == few_queries
+    assert sorted(test['questions_count'] for test in many) == sorted(i % 4 + 1 for i in range(33))
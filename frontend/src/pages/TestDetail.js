@@ -19,6 +19,12 @@ const TestDetail = () => {
   const [showNameInput, setShowNameInput] = useState(true);
   const [startTime, setStartTime] = useState(null);
   const [user, setUser] = useState(null);
+  // Ключ попытки: повтор отправки после тайм-аута не создаст второй результат
+  const [attemptKey, setAttemptKey] = useState(() => (
+    window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+  ));
 
   useEffect(() => {
     fetchTest();
@@ -43,11 +49,36 @@ const TestDetail = () => {
     return () => clearInterval(interval);
   }, [timeLeft, startTime, isSubmitted]);
 
+  // Автосохранение черновика: не чаще раза в пару секунд после изменения ответов
+  useEffect(() => {
+    if (!test || isSubmitted || Object.keys(answers).length === 0) return;
+    const timer = setTimeout(() => {
+      api.put(`/tests/${id}/draft`, {
+        answers: answers,
+        idempotency_key: attemptKey
+      }).catch(err => console.error('Error saving draft:', err));
+    }, 2000);
+    return () => clearTimeout(timer);
+  }, [answers, test, isSubmitted]);
+
   const fetchTest = async () => {
     try {
       setLoading(true);
+      // Черновик после перезагрузки страницы: продолжаем ту же попытку
+      let draft = null;
+      try {
+        const draftResponse = await api.get(`/tests/${id}/draft`);
+        draft = draftResponse.data.data;
+      } catch (err) {
+        console.error('Error fetching draft:', err);
+      }
+      // Вариант вопросов сервер помнит сам: повторное открытие вернёт тот же набор
       const response = await api.get(`/tests/${id}`);
       if (response.data.success) {
+        if (draft) {
+          setAnswers(draft.answers || {});
+          if (draft.idempotency_key) setAttemptKey(draft.idempotency_key);
+        }
         const testData = response.data.data;
         setTest(testData);
         setQuestions(testData.questions || []);
@@ -102,7 +133,8 @@ const TestDetail = () => {
       const response = await api.post(`/tests/${id}/submit`, {
         student_name: studentName,
         answers: answers,
-        time_taken: timeTaken
+        time_taken: timeTaken,
+        idempotency_key: attemptKey
       });
 
       if (response.data.success) {
@@ -299,6 +331,16 @@ const TestDetail = () => {
           <div className="question-body">
             <p className="question-text">{currentQ.question_text}</p>
             
+            {currentQ.question_type === 'code' ? (
+              <textarea
+                className="code-answer"
+                rows={12}
+                spellCheck={false}
+                placeholder="Напишите решение на Python"
+                value={answers[currentQ.id] || ''}
+                onChange={(e) => handleAnswerChange(currentQ.id, e.target.value)}
+              />
+            ) : (
             <div className="options">
               {['a', 'b', 'c', 'd'].map(option => {
                 const optionText = currentQ[`option_${option.toLowerCase()}`];
@@ -322,6 +364,7 @@ const TestDetail = () => {
                 );
               })}
             </div>
+            )}
           </div>
         </div>
       </div>